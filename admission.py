@@ -0,0 +1,269 @@
+import os
+import io
+import time
+import random
+import socket
+import struct
+import threading
+import logging
+from PIL import Image
+from filters import output_format, encode_image, apply_step, working_size, draft_size
+
+logger = logging.getLogger(__name__)
+
+# ========== 成本模型 ==========
+# 各处理步骤每百万像素的CPU耗时（毫秒），由 calibrate() 测得（运行 python admission.py 重新测量）
+STEP_COST_MS_PER_MP = {
+    'brightness': 25,
+    'color': 22,
+    'contrast': 22,
+    'blur': 58,
+    'sharpen': 40,
+    'channels': 9,
+    'shift': 7,
+    'grain': 45,
+}
+BASE_COST_MS_PER_MP = 40  # 解码 + 古早像素缩放
+ENCODE_COST_MS_PER_MP = {
+    # (输出格式, 快速编码): 毫秒/百万像素
+    ('JPEG', False): 55,
+    ('JPEG', True): 11,
+    ('PNG', False): 280,
+    ('PNG', True): 230,
+}
+COST_CORRECTION_ALPHA = 0.2  # 实测耗时修正系数的平滑权重
+
+# ========== 令牌桶配置（令牌单位：CPU毫秒，按每个 worker 进程计） ==========
+# 令牌桶保存在各 worker 进程内存中，不跨进程共享：N 个 worker 时整体预算和
+# 单个客户端的预算都约为配置值的 N 倍（请求被分配到哪个 worker 不确定，属于近似限流）
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', '1') != '0'
+GLOBAL_CPU_MS_PER_SEC = float(os.environ.get('ADMISSION_CPU_MS_PER_SEC', 1000))  # 同步worker每秒最多1核
+GLOBAL_BURST_MS = float(os.environ.get('ADMISSION_BURST_MS', 60000))
+CLIENT_CPU_MS_PER_SEC = float(os.environ.get('ADMISSION_CLIENT_CPU_MS_PER_SEC', 250))
+CLIENT_BURST_MS = float(os.environ.get('ADMISSION_CLIENT_BURST_MS', 30000))
+MAX_TRACKED_CLIENTS = 10000
+
+# ========== 排队检测 ==========
+# 同步 worker 取到请求时令牌桶总是刚好回满，看不到在监听队列里排队的请求；
+# 假设排队的请求与当前请求成本相近，按 排队数 x 各档成本 估算排队时间，
+# 选择排队时间不超过上限的最高档位，最低档位仍超过上限时直接返回503
+ADMISSION_MAX_QUEUE_WAIT = float(os.environ.get('ADMISSION_MAX_QUEUE_WAIT', 5))  # 秒
+ADMISSION_WORKERS = int(os.environ.get('WEB_CONCURRENCY', 1))  # gunicorn/uvicorn 的默认 worker 数也读取该变量
+
+# 降级档位：依次降低编码开销和工作分辨率，直到成本能被令牌桶接受
+DEGRADE_LEVELS = [
+    {'max_pixels': None, 'fast_encode': False},
+    {'max_pixels': None, 'fast_encode': True},
+    {'max_pixels': 4000000, 'fast_encode': True},
+    {'max_pixels': 2000000, 'fast_encode': True},
+    {'max_pixels': 1000000, 'fast_encode': True},
+]
+
+class AdmissionRejected(Exception):
+    """请求被准入控制拒绝（429：单个客户端超额，503：服务整体繁忙）"""
+
+    def __init__(self, status, retry_after):
+        super().__init__(f"Request rejected by admission control ({status})")
+        self.status = status
+        self.retry_after = retry_after
+
+_listen_sockets = None
+_listen_sockets_lock = threading.Lock()
+
+def _find_listen_sockets():
+    """找出进程继承的 TCP 监听 socket（gunicorn/uvicorn 的 worker 与主进程共享同一个）"""
+    sockets = []
+    try:
+        fds = [int(fd) for fd in os.listdir('/proc/self/fd')]
+    except OSError:
+        return sockets
+    for fd in fds:
+        try:
+            sock = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
+        except OSError:
+            continue
+        try:
+            listening = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ACCEPTCONN)
+            tcp = sock.family in (socket.AF_INET, socket.AF_INET6) and sock.type == socket.SOCK_STREAM
+        except OSError:
+            listening = tcp = False
+        if listening and tcp:
+            sockets.append(sock)
+        else:
+            sock.close()
+    return sockets
+
+def listen_backlog():
+    """监听队列中等待 accept 的连接数（Linux TCP_INFO），无法获取时返回 0"""
+    global _listen_sockets
+    if not hasattr(socket, 'TCP_INFO'):
+        return 0
+    with _listen_sockets_lock:
+        if _listen_sockets is None:
+            _listen_sockets = _find_listen_sockets()
+    total = 0
+    for sock in _listen_sockets:
+        try:
+            # 监听 socket 的 tcpi_unacked 字段即当前 accept 队列长度
+            total += struct.unpack_from('I', sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104), 24)[0]
+        except (OSError, struct.error):
+            pass
+    return total
+
+def probe_image(image_data):
+    """只读取图片头部，返回 (宽, 高, 格式)，无法识别时返回 None"""
+    try:
+        img = Image.open(io.BytesIO(image_data))
+        return img.width, img.height, img.format
+    except Exception:
+        return None
+
+def decoded_pixels(width, height, input_format, draft_width, draft_height):
+    """解码阶段实际生成的像素数：JPEG 可按 1/2、1/4、1/8 缩放解码，其他格式按原图解码"""
+    scale = 1
+    if input_format == 'JPEG':
+        while scale < 8 and width // (scale * 2) >= draft_width and height // (scale * 2) >= draft_height:
+            scale *= 2
+    return (width // scale) * (height // scale)
+
+class CostModel:
+    """按像素数和滤镜步骤估算CPU耗时，并用实测耗时持续修正"""
+
+    def __init__(self, filter_steps):
+        self.filter_steps = filter_steps
+        self.corrections = {}
+        self.lock = threading.Lock()
+
+    def estimate(self, filter_name, width, height, input_format, max_pixels=None, fast_encode=False):
+        work_width, work_height = working_size((width, height), max_pixels)
+        mp = work_width * work_height / 1000000
+        draft_width, draft_height = draft_size((work_width, work_height), max_pixels)
+        cost = BASE_COST_MS_PER_MP * decoded_pixels(width, height, input_format, draft_width, draft_height) / 1000000
+        for op, _ in self.filter_steps.get(filter_name, []):
+            cost += STEP_COST_MS_PER_MP.get(op, 0) * mp
+        cost += ENCODE_COST_MS_PER_MP[(output_format(input_format), fast_encode)] * mp
+        return cost * self.corrections.get(filter_name, 1.0)
+
+    def observe(self, filter_name, estimated_ms, actual_ms):
+        """记录实测耗时，更新该滤镜的修正系数"""
+        if estimated_ms <= 0:
+            return
+        with self.lock:
+            raw_estimate = estimated_ms / self.corrections.get(filter_name, 1.0)
+            ratio = actual_ms / raw_estimate
+            old = self.corrections.get(filter_name, 1.0)
+            self.corrections[filter_name] = old + COST_CORRECTION_ALPHA * (ratio - old)
+
+class TokenBucket:
+    """令牌桶：按固定速率补充令牌，容量即允许的突发量"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def can_afford(self, cost):
+        return self.tokens >= min(cost, self.capacity)
+
+    def retry_after(self, cost):
+        """令牌足够支付 cost 前需要等待的秒数"""
+        return max(0.0, (min(cost, self.capacity) - self.tokens) / self.rate)
+
+def queue_wait(queued, cost):
+    """queued 个成本为 cost 毫秒的请求全部处理完需要的秒数"""
+    return queued * cost / (GLOBAL_CPU_MS_PER_SEC * ADMISSION_WORKERS)
+
+class AdmissionController:
+    """全局 + 每客户端令牌桶；令牌不足时先降级，降级到底仍不足才拒绝"""
+
+    def __init__(self, cost_model):
+        self.cost_model = cost_model
+        self.global_bucket = TokenBucket(GLOBAL_CPU_MS_PER_SEC, GLOBAL_BURST_MS)
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def _client_bucket(self, client, now):
+        bucket = self.clients.get(client)
+        if bucket is None:
+            if len(self.clients) >= MAX_TRACKED_CLIENTS:
+                self._prune_clients(now)
+            bucket = self.clients[client] = TokenBucket(CLIENT_CPU_MS_PER_SEC, CLIENT_BURST_MS)
+        bucket.refill(now)
+        return bucket
+
+    def _prune_clients(self, now):
+        # 已经回满的桶与新建的桶等价，可以直接丢弃
+        for client, bucket in list(self.clients.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self.clients[client]
+        if len(self.clients) >= MAX_TRACKED_CLIENTS:
+            self.clients.clear()
+
+    def admit(self, client, filter_name, width, height, input_format, queued=0):
+        """返回 (降级参数, 估算耗时)；无法接受时抛出 AdmissionRejected
+
+        queued 为正在排队、尚未进入应用的请求数（监听队列 + ASGI 线程池队列）
+        """
+        costs = []
+        work_width, work_height = working_size((width, height))
+        for index, level in enumerate(DEGRADE_LEVELS):
+            if level['max_pixels'] and level['max_pixels'] >= work_width * work_height:
+                continue
+            costs.append((index, level, self.cost_model.estimate(filter_name, width, height, input_format, **level)))
+
+        if not ADMISSION_ENABLED:
+            return costs[0][1:]
+
+        # 排队较多时跳过会让队列等待超过上限的档位；最低档位也超过上限时拒绝，尽快清空队列
+        if queued:
+            costs = [c for c in costs if queue_wait(queued, c[2]) <= ADMISSION_MAX_QUEUE_WAIT]
+            if not costs:
+                raise AdmissionRejected(503, ADMISSION_MAX_QUEUE_WAIT)
+
+        with self.lock:
+            now = time.monotonic()
+            self.global_bucket.refill(now)
+            client_bucket = self._client_bucket(client, now)
+            for _, level, cost in costs:
+                # 超过桶容量的请求在桶满时也可接受，差额记为欠账，由后续补充的令牌偿还
+                if self.global_bucket.can_afford(cost) and client_bucket.can_afford(cost):
+                    self.global_bucket.tokens -= cost
+                    client_bucket.tokens -= cost
+                    return level, cost
+
+            # 最低档位仍无法接受：全局不足返回503，否则是该客户端超额返回429
+            cost = costs[-1][2]
+            if not self.global_bucket.can_afford(cost):
+                raise AdmissionRejected(503, self.global_bucket.retry_after(cost))
+            raise AdmissionRejected(429, client_bucket.retry_after(cost))
+
+    def observe(self, filter_name, estimated_ms, actual_ms):
+        self.cost_model.observe(filter_name, estimated_ms, actual_ms)
+
+def calibrate(size=(1000, 1000)):
+    """在本机测量各步骤每百万像素的耗时（毫秒）"""
+    img = Image.effect_noise(size, 64).convert('RGB')
+    mp = size[0] * size[1] / 1000000
+    rng = random.Random(0)
+    results = {}
+    for op, value in [('brightness', 1.1), ('color', 1.2), ('contrast', 1.2), ('blur', 1.5),
+                      ('sharpen', None), ('channels', (1.1, 1.0, 0.9)), ('shift', (-4, 0, 4)), ('grain', 30)]:
+        start = time.thread_time()
+        apply_step(img, (op, value), rng)
+        results[op] = (time.thread_time() - start) * 1000 / mp
+    for fmt, fast in ENCODE_COST_MS_PER_MP:
+        start = time.thread_time()
+        encode_image(img, fmt, fast)
+        results[(fmt, fast)] = (time.thread_time() - start) * 1000 / mp
+    return results
+
+if __name__ == '__main__':
+    for name, ms in calibrate().items():
+        print(f"{name}: {ms:.0f} ms/MP")
@@ -1,13 +1,27 @@
-from flask import Flask, request, render_template, flash, jsonify, redirect, url_for
+from flask import Flask, request, render_template, flash, jsonify, redirect, url_for, abort, make_response, send_from_directory
 import os
 import io
+import json
+import time
 import base64
-from filters import apply_filter
+import hashlib
+from filters import apply_filter, export_filter_definitions, FILTER_STEPS
+from admission import CostModel, AdmissionController, AdmissionRejected, probe_image, listen_backlog, DEGRADE_LEVELS
+import profiling
+import assets
+from result_cache import result_key, is_result_key, find_result, load_result, store_result, store_alias, find_alias, result_lock, in_flight, result_ttl_left, touch_result, prune_expired, RESULT_TYPES, RESULT_INLINE
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 app = Flask(__name__)
 app.secret_key = "2000sfiltersecret"
 
+# 前面有几层可信的反向代理（Railway、Nginx 等）；只有这些代理追加的 X-Forwarded-For 才可信，
+# 客户端自己伪造的值会被忽略。默认 0：直接使用连接的来源地址
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
 # 不再需要保存文件夹，所有处理都在内存中进行
 
 ALLOWED_EXTENSIONS = {'png','jpg','jpeg','bmp','gif','tiff','tif','webp','avif','heif'}
@@ -27,9 +41,92 @@ FILTER_CATEGORIES = {
 # 全局变量保留上次的滤镜选择
 LAST_FILTER = 'ccd'
 
+# 前端预览用的滤镜定义，只在部署时变化，启动时生成一次
+FILTER_DEFINITIONS_JSON = json.dumps({'filters': export_filter_definitions()}, separators=(',', ':'))
+FILTER_DEFINITIONS_ETAG = hashlib.sha256(FILTER_DEFINITIONS_JSON.encode('utf-8')).hexdigest()[:32]
+FILTER_DEFINITIONS_MAX_AGE = 3600
+
+# 按估算CPU成本做准入控制，高负载时先降级再拒绝
+ADMISSION = AdmissionController(CostModel(FILTER_STEPS))
+
+# 构建后的静态资源清单（python assets.py 生成），未构建时模板直接引用 static 下的原文件
+ASSET_MANIFEST = assets.load_manifest()
+ASSET_ENCODINGS = assets.encoded_files(ASSET_MANIFEST)
+
+@app.template_global()
+def asset_url(name):
+    """模板中引用静态资源：已构建时返回带内容哈希的URL"""
+    entry = ASSET_MANIFEST.get(name)
+    if entry is None:
+        return url_for('static', filename=name)
+    return url_for('asset', filename=entry['file'])
+
+@app.template_global()
+def asset_webp_url(name):
+    """图片的 WebP 版本URL，没有时返回 None"""
+    entry = ASSET_MANIFEST.get(name)
+    if entry is None or 'webp' not in entry:
+        return None
+    return url_for('asset', filename=entry['webp'])
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.',1)[1].lower() in ALLOWED_EXTENSIONS
 
+def client_address():
+    # 按客户端限流的依据，不能直接读取 X-Forwarded-For（客户端可以随意伪造）
+    return request.remote_addr
+
+def process_upload(file_data, filter_name):
+    """处理上传的图片，返回 (结果哈希, 扩展名, 是否降级)"""
+    # 结果按内容寻址：相同图片+滤镜只处理一次
+    prune_expired()
+    key = result_key(file_data, filter_name)
+    cached = find_result(key)
+    if cached:
+        touch_result(key, cached)
+        return key, cached, False
+
+    # 相同请求正在处理（双击、热门图片）时排在它后面，共享它的结果（包括降级结果），不重复计费；
+    # 锁按全画质结果加，覆盖准入和整个计算过程，降级与否都能合并
+    waited = in_flight(key)
+    with result_lock(key):
+        cached = find_result(key)
+        if cached:
+            touch_result(key, cached)
+            return key, cached, False
+        alias = find_alias(key) if waited else None
+        if alias:
+            touch_result(*alias)
+            return alias[0], alias[1], True
+
+        # 按图片尺寸和滤镜估算成本，令牌不足时降级或拒绝
+        level, estimated_ms = DEGRADE_LEVELS[0], 0
+        info = probe_image(file_data)
+        if info:
+            queued = listen_backlog() + request.environ.get('asgi.queued_requests', 0)
+            level, estimated_ms = ADMISSION.admit(client_address(), filter_name, *info, queued=queued)
+        degraded = level != DEGRADE_LEVELS[0]
+        if degraded:
+            full_key, key = key, result_key(file_data, filter_name, **level)
+            cached = find_result(key)
+            if cached:
+                touch_result(key, cached)
+                store_alias(full_key, key)
+                return key, cached, True
+
+        # 直接在内存中应用滤镜（用内容哈希做噪点种子，保证同一URL内容不变）
+        width, height, image_format = info or (0, 0, None)
+        with profiling.capture(profiling.requested_mode(request.headers), filter_name, width, height, image_format) as stage:
+            start = time.thread_time()
+            band_cpu_ms = []
+            processed_data = apply_filter(file_data, filter_name, seed=key, stage=stage, band_cpu_ms=band_cpu_ms,
+                                          parallel=profiling.active_mode() != 'cprofile', **level)
+            ADMISSION.observe(filter_name, estimated_ms, (time.thread_time() - start) * 1000 + sum(band_cpu_ms))
+        ext = store_result(key, processed_data)
+        if degraded:
+            store_alias(full_key, key)
+        return key, ext, degraded
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     global LAST_FILTER
@@ -52,20 +149,31 @@ def index():
                         'error': 'Uploaded file is empty, please select a valid image file'
                     })
                 
-                # 直接在内存中应用滤镜
-                processed_data = apply_filter(file_data, filter_name)
+                key, ext, degraded = process_upload(file_data, filter_name)
                 LAST_FILTER = filter_name
                 
-                # 将处理后的图片转换为base64编码
-                processed_base64 = base64.b64encode(processed_data).decode('utf-8')
-                
-                # 返回JSON响应，包含base64图片数据
+                # 返回JSON响应，包含可缓存的结果URL；实例间不共享缓存目录时内联返回图片数据
+                if RESULT_INLINE:
+                    processed_base64 = base64.b64encode(load_result(key, ext)).decode('utf-8')
+                    filtered_image = f'data:{RESULT_TYPES[ext]};base64,{processed_base64}'
+                else:
+                    filtered_image = url_for('result', key=key, ext=ext)
                 return jsonify({
                     'success': True,
-                    'filtered_image': f'data:image/jpeg;base64,{processed_base64}',
-                    'filter_name': filter_name
+                    'filtered_image': filtered_image,
+                    'filter_name': filter_name,
+                    'degraded': degraded
                 })
                 
+            except AdmissionRejected as e:
+                # 降级后仍超出处理能力，让客户端稍后重试
+                response = jsonify({
+                    'success': False,
+                    'error': 'Too many requests, please try again in a moment' if e.status == 429 else 'Server is busy, please try again in a moment'
+                })
+                response.status_code = e.status
+                response.headers['Retry-After'] = str(max(1, int(e.retry_after + 0.5)))
+                return response
             except ValueError as e:
                 # 用户输入错误（文件过大、格式不支持等）
                 return jsonify({
@@ -86,6 +194,19 @@ def index():
     
     return render_template('index.html', filters=FILTERS, selected_filter=LAST_FILTER, filter_categories=FILTER_CATEGORIES)
 
+@app.route('/filters.json')
+def filter_definitions():
+    # 内容只随代码变化，通过ETag重新验证
+    if request.if_none_match.contains(FILTER_DEFINITIONS_ETAG):
+        response = make_response('', 304)
+    else:
+        response = make_response(FILTER_DEFINITIONS_JSON)
+        response.mimetype = 'application/json'
+    response.set_etag(FILTER_DEFINITIONS_ETAG)
+    response.cache_control.public = True
+    response.cache_control.max_age = FILTER_DEFINITIONS_MAX_AGE
+    return response
+
 @app.route('/faq')
 def faq():
     return render_template('faq.html')
@@ -102,7 +223,78 @@ def contact():
 def privacy():
     return render_template('privacy.html')
 
-# 不再需要下载路由，图片直接通过主路由返回
+def require_profile_token():
+    # 未配置 PROFILE_SECRET 时管理接口不存在
+    if not profiling.PROFILE_SECRET:
+        abort(404)
+    if not profiling.verify_token(request.headers.get('X-Profile-Token')):
+        abort(403)
+
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+def profiling_toggle():
+    require_profile_token()
+    if request.method == 'POST':
+        # minutes=0 关闭；mode 为 cprofile 或 tracemalloc
+        mode = request.form.get('mode', 'cprofile')
+        if mode not in profiling.PROFILE_MODES:
+            return jsonify({'success': False, 'error': f'Unknown mode, supported: {", ".join(profiling.PROFILE_MODES)}'}), 400
+        try:
+            minutes = float(request.form.get('minutes', 10))
+        except ValueError:
+            return jsonify({'success': False, 'error': 'minutes must be a number'}), 400
+        profiling.set_toggle(minutes, mode)
+    return jsonify({'success': True, 'toggle': profiling.get_toggle(), 'sample_rate': profiling.PROFILE_SAMPLE_RATE})
+
+@app.route('/admin/profiles')
+def profile_list():
+    require_profile_token()
+    return jsonify({'success': True, 'profiles': profiling.list_profiles()})
+
+@app.route('/admin/profiles/<name>')
+def profile_download(name):
+    require_profile_token()
+    return send_from_directory(profiling.PROFILE_DIR, name, as_attachment=True)
+
+@app.route('/result/<key>.<ext>')
+def result(key, ext):
+    if not is_result_key(key) or ext not in RESULT_TYPES:
+        abort(404)
+    
+    # 结果只保留 RESULT_CACHE_TTL，过期后即使客户端带着 ETag 也返回404
+    prune_expired()
+    ttl_left = result_ttl_left(key, ext)
+    if ttl_left is None:
+        abort(404)
+    
+    # 结果内容由URL中的哈希决定，永不变化，ETag直接使用该哈希
+    if request.if_none_match.contains(key):
+        response = make_response('', 304)
+    else:
+        data = load_result(key, ext)
+        if data is None:
+            abort(404)
+        response = make_response(data)
+        response.mimetype = RESULT_TYPES[ext]
+    response.set_etag(key)
+    # 用户照片：只允许浏览器缓存到删除时间为止，CDN 和共享缓存不得保存
+    response.cache_control.private = True
+    response.cache_control.max_age = int(ttl_left)
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    # 文件名带内容哈希，内容永不变化；CSS/JS 按 Accept-Encoding 返回预压缩版本
+    encodings = ASSET_ENCODINGS.get(filename, [])
+    chosen = assets.choose_encoding(request.accept_encodings, encodings)
+    response = send_from_directory(assets.ASSET_DIR, filename + chosen[1] if chosen else filename,
+                                   mimetype=assets.asset_mimetype(filename), max_age=assets.ASSET_MAX_AGE)
+    if chosen:
+        response.content_encoding = chosen[0]
+    if encodings:
+        response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))  # Railway 会注入 PORT，本地默认 5000
@@ -0,0 +1,160 @@
+"""ASGI 入口：与 app:app 提供相同的路由和模板
+
+慢速上传由事件循环异步接收，请求体完整到达后才交给线程池中的 Flask 应用处理，
+事件循环本身从不执行滤镜代码。超过 ASGI_SPOOL_SIZE 的请求体暂存到临时文件，
+排队等待线程池的请求不会占用大量内存。运行方式：
+    uvicorn asgi:application --host 0.0.0.0 --port $PORT --workers 2
+"""
+import os
+import sys
+import asyncio
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app import app
+from filters import MAX_FILE_SIZE
+
+# 执行 Flask 应用（包括滤镜处理）的线程数；滤镜受 GIL 限制，多核靠多开 worker 进程
+ASGI_WORKER_THREADS = int(os.environ.get('ASGI_WORKER_THREADS', 4))
+# 请求体上限：最大图片 + 表单字段开销
+MAX_BODY_SIZE = MAX_FILE_SIZE + 1024 * 1024
+# 请求体在内存中最多保留的字节数，超过后转存到临时文件
+ASGI_SPOOL_SIZE = int(os.environ.get('ASGI_SPOOL_SIZE', 1024 * 1024))
+
+EXECUTOR = ThreadPoolExecutor(max_workers=ASGI_WORKER_THREADS, thread_name_prefix='wsgi')
+
+# 已收完请求体、正在等待线程池的请求数，通过 environ 告诉准入控制
+_queued = 0
+_queued_lock = threading.Lock()
+
+class BodyTooLarge(Exception):
+    pass
+
+async def read_body(receive):
+    """异步读取完整请求体，期间不占用任何处理线程
+
+    返回 (已回到开头的 SpooledTemporaryFile, 字节数)；客户端中途断开时返回 None
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=ASGI_SPOOL_SIZE)
+    size = 0
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > MAX_BODY_SIZE:
+                raise BodyTooLarge()
+            body.write(chunk)
+            if not message.get('more_body', False):
+                body.seek(0)
+                return body, size
+    except BaseException:
+        body.close()
+        raise
+
+def build_environ(scope, body, size):
+    """按 PEP 3333 把 ASGI scope 转换为 WSGI environ"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(size),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            separator = '; ' if name == 'COOKIE' else ','
+            environ[key] = f'{environ[key]}{separator}{value}' if key in environ else value
+    return environ
+
+def run_wsgi(environ):
+    """在线程池中运行 Flask 应用，返回 (状态码, 响应头, 响应体)"""
+    global _queued
+    with _queued_lock:
+        _queued -= 1
+        environ['asgi.queued_requests'] = _queued
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+    try:
+        result = app(environ, start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+    finally:
+        # 请求体临时文件只在本次请求内使用
+        environ['wsgi.input'].close()
+    return response['status'], response['headers'], body
+
+async def send_simple(send, status, text):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+    await send({'type': 'http.response.body', 'body': text.encode('utf-8')})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            EXECUTOR.shutdown(wait=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    # 声明的长度已超限时直接拒绝，不再接收请求体
+    content_length = dict(scope['headers']).get(b'content-length', b'0')
+    if content_length.isdigit() and int(content_length) > MAX_BODY_SIZE:
+        await send_simple(send, 413, f'Request body too large, maximum supported: {MAX_FILE_SIZE / (1024*1024):.0f}MB')
+        return
+
+    try:
+        received = await read_body(receive)
+    except BodyTooLarge:
+        await send_simple(send, 413, f'Request body too large, maximum supported: {MAX_FILE_SIZE / (1024*1024):.0f}MB')
+        return
+    if received is None:
+        # 客户端在上传完成前断开，不需要任何处理
+        return
+
+    global _queued
+    with _queued_lock:
+        _queued += 1
+    body, size = received
+    loop = asyncio.get_running_loop()
+    status, headers, response_body = await loop.run_in_executor(EXECUTOR, run_wsgi, build_environ(scope, body, size))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': response_body})
@@ -0,0 +1,203 @@
+"""静态资源构建：压缩 CSS/JS、按内容哈希重命名，并预生成 gzip/brotli 和 WebP 版本
+
+运行 python assets.py 后输出到 static/dist，同时写入 manifest.json（原文件名 -> 构建产物）。
+模板通过 asset_url / asset_webp_url 引用资源；manifest 不存在时退回原始 static 文件，
+本地开发不需要先构建。
+"""
+import os
+import io
+import json
+import gzip
+import shutil
+import hashlib
+import logging
+import mimetypes
+from PIL import Image
+
+# brotli 已列入 requirements.txt；万一未安装则只生成 gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+ASSET_DIR = os.path.join(STATIC_DIR, 'dist')
+ASSET_MANIFEST_FILE = os.path.join(ASSET_DIR, 'manifest.json')
+ASSET_MAX_AGE = 365 * 24 * 3600  # 文件名包含内容哈希，内容永不变化，可缓存一年
+
+# 需要构建的资源：(目录或文件, 类型)
+ASSET_SOURCES = [
+    ('css/style.css', 'css'),
+    ('js/script.js', 'js'),
+    ('ads', 'image'),
+    ('examples', 'image'),
+]
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+WEBP_QUALITY = 82
+# 预压缩格式：(Accept-Encoding 名称, 文件后缀)，按优先级排列
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+# ========== 压缩 ==========
+
+def _split_code(source, line_comments):
+    """把源码切分为 (是否为代码, 文本) 片段，去掉注释，保留字符串原样
+
+    只识别引号字符串、模板字符串和注释，不处理正则字面量（script.js 中没有）
+    """
+    parts = []
+    code = []
+    i = 0
+    n = len(source)
+    while i < n:
+        c = source[i]
+        if source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+            code.append(' ')
+        elif line_comments and source.startswith('//', i):
+            end = source.find('\n', i)
+            i = n if end < 0 else end
+        elif c in '\'"`':
+            j = i + 1
+            while j < n and source[j] != c:
+                j += 2 if source[j] == '\\' else 1
+            parts.append((True, ''.join(code)))
+            parts.append((False, source[i:j + 1]))
+            code = []
+            i = j + 1
+        else:
+            code.append(c)
+            i += 1
+    parts.append((True, ''.join(code)))
+    return parts
+
+def minify_css(source):
+    """去掉注释和多余空白；不改写选择器和属性值"""
+    out = []
+    for is_code, text in _split_code(source, line_comments=False):
+        if is_code:
+            text = ' '.join(text.split())
+            for token in '{};,>':
+                text = text.replace(f' {token}', token).replace(f'{token} ', token)
+            text = text.replace(': ', ':').replace(';}', '}')
+        out.append(text)
+    return ''.join(out).strip()
+
+def minify_js(source):
+    """保守压缩：去掉注释、缩进和空行，保留换行以免影响自动分号插入"""
+    out = []
+    for is_code, text in _split_code(source, line_comments=True):
+        if is_code:
+            lines = [line.strip() for line in text.split('\n')]
+            text = '\n'.join(lines)
+            while '\n\n' in text:
+                text = text.replace('\n\n', '\n')
+        out.append(text)
+    return ''.join(out).strip() + '\n'
+
+MINIFIERS = {'css': minify_css, 'js': minify_js}
+
+# ========== 构建 ==========
+
+def fingerprint(name, data):
+    """style.css -> style.<内容哈希>.css"""
+    base, ext = os.path.splitext(name)
+    return f'{base}.{hashlib.sha256(data).hexdigest()[:10]}{ext}'
+
+def _write(name, data):
+    path = os.path.join(ASSET_DIR, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def _compressed_variants(data):
+    """返回比原文件更小的预压缩版本 {编码: 数据}"""
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in variants.items() if len(body) < len(data)}
+
+def _webp_variant(data):
+    """转换为 WebP，比原图小时返回数据，否则返回 None"""
+    img = Image.open(io.BytesIO(data))
+    if img.format == 'WEBP':
+        return None
+    img = img.convert('RGBA' if img.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    buf = io.BytesIO()
+    img.save(buf, format='WEBP', quality=WEBP_QUALITY, method=6)
+    webp = buf.getvalue()
+    return webp if len(webp) < len(data) else None
+
+def _source_files():
+    """展开 ASSET_SOURCES，返回 [(相对路径, 类型)]"""
+    files = []
+    for source, kind in ASSET_SOURCES:
+        path = os.path.join(STATIC_DIR, source)
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    files.append((f'{source}/{name}', kind))
+        else:
+            files.append((source, kind))
+    return files
+
+def build():
+    """重新生成 static/dist 和 manifest，返回 manifest"""
+    shutil.rmtree(ASSET_DIR, ignore_errors=True)
+    manifest = {}
+    for name, kind in _source_files():
+        with open(os.path.join(STATIC_DIR, name), 'rb') as f:
+            data = f.read()
+        if kind in MINIFIERS:
+            data = MINIFIERS[kind](data.decode('utf-8')).encode('utf-8')
+        entry = {'file': fingerprint(name, data)}
+        _write(entry['file'], data)
+
+        if kind in MINIFIERS:
+            variants = _compressed_variants(data)
+            for encoding, suffix in ENCODINGS:
+                if encoding in variants:
+                    _write(entry['file'] + suffix, variants[encoding])
+            entry['encodings'] = [encoding for encoding, _ in ENCODINGS if encoding in variants]
+        else:
+            webp = _webp_variant(data)
+            if webp is not None:
+                entry['webp'] = fingerprint(os.path.splitext(name)[0] + '.webp', webp)
+                _write(entry['webp'], webp)
+        manifest[name] = entry
+
+    with open(ASSET_MANIFEST_FILE, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+# ========== 运行时 ==========
+
+def load_manifest():
+    """读取构建产物清单，未构建时返回空字典"""
+    try:
+        with open(ASSET_MANIFEST_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def encoded_files(manifest):
+    """构建产物文件名 -> 可用的预压缩编码列表"""
+    return {entry['file']: entry.get('encodings', []) for entry in manifest.values()}
+
+def choose_encoding(accept_encodings, available):
+    """按服务端优先级选出客户端接受的预压缩版本，返回 (编码, 后缀) 或 None"""
+    for encoding, suffix in ENCODINGS:
+        if encoding in available and accept_encodings[encoding]:
+            return encoding, suffix
+    return None
+
+def asset_mimetype(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+if __name__ == '__main__':
+    result = build()
+    for name, entry in sorted(result.items()):
+        extras = entry.get('encodings', []) + (['webp'] if 'webp' in entry else [])
+        print(f"{name} -> {entry['file']}" + (f" ({', '.join(extras)})" if extras else ''))
@@ -1,7 +1,12 @@
-from PIL import Image, ImageEnhance, ImageOps, ImageFilter
+from PIL import Image, ImageEnhance, ImageOps, ImageFilter, ImageChops, ImageStat
+import os
+import math
+import time
 import random
 import io
+import base64
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 # 尝试导入HEIF/AVIF支持
 try:
@@ -21,9 +26,24 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # 图片处理配置
-MAX_IMAGE_SIZE = (4096, 4096)  # 最大支持4K图片
+MAX_IMAGE_SIZE = (4096, 4096)  # 工作尺寸上限，更大的图片在解码时缩小到该尺寸
+MAX_INPUT_PIXELS = int(os.environ.get('MAX_INPUT_PIXELS', 200 * 1000 * 1000))  # 允许上传的最大像素数（默认2亿像素）
+# 不支持缩放解码的格式（PNG、TIFF、WebP 等）必须先按原尺寸完整解码，像素上限单独控制
+MAX_FULL_DECODE_PIXELS = int(os.environ.get('MAX_FULL_DECODE_PIXELS', MAX_IMAGE_SIZE[0] * MAX_IMAGE_SIZE[1]))
+SCALED_DECODE_FORMATS = ('JPEG',)  # 解码器可以直接输出缩小图的格式
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 最大文件大小50MB
 SUPPORTED_FORMATS = ['JPEG', 'PNG', 'BMP', 'GIF', 'TIFF', 'WEBP', 'AVIF', 'HEIF']
+PIXELATE_FACTOR = 2  # 古早像素缩放倍数
+FILTER_VERSION = 3  # 渲染结果变化时加一，使旧的缓存结果失效
+
+# 分条带并行处理：条带高度固定，输出与线程数、调度顺序无关
+BAND_HEIGHT = 256
+FILTER_THREADS = int(os.environ.get('FILTER_THREADS', os.cpu_count() or 1))  # 1 表示不并行
+PARALLEL_MIN_PIXELS = 1000000  # 小图并行收益不如调度开销
+_band_executor = ThreadPoolExecutor(max_workers=FILTER_THREADS, thread_name_prefix='band') if FILTER_THREADS > 1 else None
+
+# Pillow 的解压炸弹保护与像素上限保持一致
+Image.MAX_IMAGE_PIXELS = MAX_INPUT_PIXELS
 
 def validate_image(image_data):
     """验证图片数据"""
@@ -42,729 +62,415 @@ def validate_image(image_data):
                 return False, f"HEIF/AVIF format detected but pillow-heif not installed. Please install: pip install pillow-heif"
             return False, f"Unsupported image format ({img.format}), supported formats: {', '.join(SUPPORTED_FORMATS)}"
         
-        # 检查图片尺寸
-        if img.size[0] > MAX_IMAGE_SIZE[0] or img.size[1] > MAX_IMAGE_SIZE[1]:
-            return False, f"Image dimensions too large ({img.size[0]}x{img.size[1]}), maximum supported: {MAX_IMAGE_SIZE[0]}x{MAX_IMAGE_SIZE[1]}"
+        # 检查像素总数（JPEG 超过工作尺寸时在解码阶段缩小，其他格式只能完整解码，上限更低）
+        if img.size[0] * img.size[1] > MAX_INPUT_PIXELS:
+            return False, f"Image dimensions too large ({img.size[0]}x{img.size[1]}), maximum supported: {MAX_INPUT_PIXELS / 1000000:.0f} megapixels"
+        if img.format not in SCALED_DECODE_FORMATS and img.size[0] * img.size[1] > MAX_FULL_DECODE_PIXELS:
+            return False, f"Image dimensions too large ({img.size[0]}x{img.size[1]}), maximum supported for {img.format}: {MAX_FULL_DECODE_PIXELS / 1000000:.1f} megapixels (JPEG up to {MAX_INPUT_PIXELS / 1000000:.0f} megapixels)"
         
         return True, "Image validation passed"
         
+    except Image.DecompressionBombError:
+        return False, f"Image dimensions too large, maximum supported: {MAX_INPUT_PIXELS / 1000000:.0f} megapixels"
     except Exception as e:
         logger.error(f"Image validation failed: {str(e)}")
         return False, f"Image file corrupted or format error: {str(e)}"
 
-def smart_resize(img):
-    """智能缩放图片，保持宽高比"""
+def working_size(size, max_pixels=None):
+    """计算实际处理尺寸：不超过 MAX_IMAGE_SIZE 和 max_pixels，保持宽高比"""
+    width, height = size
+    ratio = min(1.0, MAX_IMAGE_SIZE[0] / width, MAX_IMAGE_SIZE[1] / height)
+    if max_pixels and width * height * ratio * ratio > max_pixels:
+        ratio = (max_pixels / (width * height)) ** 0.5
+    if ratio >= 1.0:
+        return size
+    return (max(1, int(width * ratio)), max(1, int(height * ratio)))
+
+def draft_size(target, max_pixels=None):
+    """JPEG 缩放解码请求的尺寸：解码器输出不小于该尺寸的最小一档
+
+    降级时（max_pixels 不为空）古早像素缩放本来就会丢掉一半细节，
+    可以解码到更小一档再放大到工作尺寸，减少解码内存
+    """
+    if max_pixels:
+        return (max(1, target[0] // PIXELATE_FACTOR), max(1, target[1] // PIXELATE_FACTOR))
+    return target
+
+def resize_banded(img, size):
+    """按输出条带逐段 LANCZOS 缩放，结果与整图缩放一致
+
+    整图缩放会先生成一张"目标宽 x 原图高"的中间图，大图时比结果本身还大；
+    逐条带缩放时中间图只有一个条带的大小
+    """
+    width, height = size
+    scale_y = img.height / height
+    result = Image.new(img.mode, size)
+    for top in range(0, height, BAND_HEIGHT):
+        bottom = min(height, top + BAND_HEIGHT)
+        box = (0, top * scale_y, img.width, bottom * scale_y)
+        result.paste(img.resize((width, bottom - top), Image.LANCZOS, box=box), (0, top))
+    return result
+
+def open_scaled(image_data, max_pixels=None):
+    """打开图片，并在解码阶段就缩小到工作尺寸，避免生成完整尺寸的位图
+
+    JPEG 利用 DCT 缩放直接按 1/2、1/4、1/8 解码；其他格式解码后先用
+    reduce 做整数倍快速缩小，最后再用 LANCZOS 精确缩放到工作尺寸
+    """
+    img = Image.open(io.BytesIO(image_data))
+    original_format = img.format
     original_size = img.size
+    target = working_size(img.size, max_pixels)
+    if target == img.size:
+        return img, original_format
     
-    # 如果图片尺寸在合理范围内，直接返回
-    if img.size[0] <= MAX_IMAGE_SIZE[0] and img.size[1] <= MAX_IMAGE_SIZE[1]:
-        return img, False
-    
-    # 计算缩放比例
-    ratio = min(MAX_IMAGE_SIZE[0] / img.size[0], MAX_IMAGE_SIZE[1] / img.size[1])
-    new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
+    # 只对 JPEG 生效：解码器直接输出不小于 draft_size 的缩小图
+    img.draft('RGB', draft_size(target, max_pixels))
     
-    # 使用高质量缩放
-    resized_img = img.resize(new_size, Image.LANCZOS)
+    # 整数倍快速缩小，剩余部分交给高质量缩放
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    factor = min(img.width // target[0], img.height // target[1])
+    if factor >= 2:
+        img = img.reduce(factor)
+    if img.size != target:
+        img = resize_banded(img, target)
     
-    logger.info(f"图片已缩放：{original_size} -> {new_size}")
-    return resized_img, True
+    logger.info(f"图片已缩放：{original_size} -> {img.size}")
+    return img, original_format
 
-def add_grain_pure_pil(img, intensity=30):
-    """在图片上加颗粒噪点（纯 PIL，不依赖 numpy）"""
+def add_grain_pure_pil(img, intensity=30, rng=None):
+    """在图片上加颗粒噪点（纯 PIL，不依赖 numpy）
+
+    每个通道加 [-intensity, intensity] 的均匀整数噪点；噪点由随机字节经查找表映射后
+    与原图相加，全部在 Pillow 的 C 代码中完成
+    """
+    rng = rng or random
     img = img.convert('RGB')
-    pixels = img.load()
-    w, h = img.size
-    for i in range(w):
-        for j in range(h):
-            r, g, b = pixels[i, j]
-            noise = lambda: random.randint(-intensity, intensity)
-            r = max(0, min(255, r + noise()))
-            g = max(0, min(255, g + noise()))
-            b = max(0, min(255, b + noise()))
-            pixels[i, j] = (r, g, b)
-    return img
-
-def apply_filter(image_data, filter_name):
-    """直接在内存中处理图片，不保存文件"""
+    span = 2 * intensity + 1
+    lut = [i * span // 256 for i in range(256)] * 3
+    noise = Image.frombytes('RGB', img.size, rng.randbytes(img.width * img.height * 3)).point(lut)
+    return ImageChops.add(img, noise, offset=-intensity)
+
+# 滤镜定义：每个滤镜是按顺序执行的处理步骤
+#   ('brightness' / 'color' / 'contrast', 系数)  ImageEnhance 调整
+#   ('blur', 半径)                               高斯模糊
+#   ('channels', (r, g, b))                      各通道乘系数
+#   ('shift', (dr, dg, db))                      各通道水平偏移像素数（正数向右）
+#   ('sharpen', None)                            锐化
+#   ('grain', 强度)                              颗粒噪点
+FILTER_STEPS = {
+    'vintage': [('channels', (1.1, 1.05, 0.9)), ('grain', 30)],
+    'ccd': [('channels', (0.8, 0.85, 1.15)), ('grain', 35)],
+    'kodachrome': [('channels', (1.05, 0.95, 1.0)), ('grain', 28)],
+    'fuji_superia': [('channels', (0.95, 1.0, 0.9)), ('grain', 28)],
+    'agfa': [('channels', (0.9, 0.95, 1.0)), ('grain', 30)],
+    'retro_green': [('channels', (0.85, 0.9, 0.85)), ('grain', 28)],
+    'dark_brown': [('channels', (0.7, 0.65, 0.6)), ('color', 0.8), ('grain', 32)],
+    'lomo': [('color', 1.5), ('contrast', 1.2), ('channels', (1.05, 1.1, 0.9)), ('grain', 35)],
+    'dreamy': [('brightness', 1.1), ('blur', 1.5), ('channels', (1.1, 1.1, 1.05)), ('grain', 30)],
+    'vhs': [('brightness', 0.9), ('contrast', 1.1), ('channels', (1.05, 1.0, 0.95)), ('grain', 40)],
+
+    # 新增滤镜
+    'vaporwave': [('color', 1.8), ('brightness', 1.1), ('channels', (1.1, 1.2, 1.5)), ('grain', 45)],
+    'glitch': [('contrast', 1.3), ('brightness', 0.9), ('shift', (0, -5, 5)), ('grain', 50)],
+    'y2k': [('color', 1.4), ('contrast', 1.2), ('channels', (1.1, 1.0, 1.1)), ('sharpen', None), ('grain', 30)],
+
+    # 新增10个2000s风格滤镜
+    # 赛博朋克风格 - 高对比度，蓝紫色调
+    'cyberpunk': [('contrast', 1.4), ('color', 1.3), ('channels', (0.8, 1.1, 1.3)), ('grain', 40)],
+    # 霓虹流行 - 高饱和度，粉紫色调
+    'neon_pop': [('color', 1.8), ('brightness', 1.1), ('channels', (1.2, 1.0, 1.4)), ('grain', 35)],
+    # 早期数码相机 - 低饱和度，偏绿
+    'digital_cam': [('color', 0.7), ('contrast', 1.1), ('channels', (0.9, 1.1, 0.8)), ('grain', 45)],
+    # 赛博粉 - 粉色调，高对比度
+    'cyber_pink': [('contrast', 1.3), ('color', 1.5), ('channels', (1.3, 0.9, 1.1)), ('grain', 30)],
+    # 复古蓝 - 蓝色调，低亮度
+    'retro_blue': [('brightness', 0.8), ('contrast', 1.2), ('channels', (0.7, 0.9, 1.2)), ('grain', 38)],
+    # 千禧金 - 金色调，温暖感
+    'millennium_gold': [('brightness', 1.1), ('color', 1.2), ('channels', (1.2, 1.1, 0.8)), ('grain', 32)],
+    # 矩阵绿 - 绿色调，电影感
+    'matrix_green': [('contrast', 1.3), ('brightness', 0.9), ('channels', (0.6, 1.2, 0.7)), ('grain', 42)],
+    # 迪斯科狂热 - 高饱和度，紫红色调
+    'disco_fever': [('color', 1.6), ('brightness', 1.05), ('channels', (1.3, 0.8, 1.2)), ('grain', 35)],
+    # 科技银 - 银色调，冷感
+    'tech_silver': [('contrast', 1.2), ('brightness', 0.95), ('channels', (0.9, 0.95, 1.0)), ('color', 0.8), ('grain', 40)],
+    # Y2K紫 - 紫色调，未来感
+    'y2k_purple': [('color', 1.4), ('contrast', 1.25), ('channels', (1.1, 0.8, 1.3)), ('grain', 33)],
+
+    # 新增8个更清晰、灰色调的Y2K风格滤镜
+    # 迷雾灰 - 轻微模糊，柔和灰色调
+    'misty_gray': [('blur', 1.5), ('brightness', 0.9), ('color', 0.5), ('channels', (0.9, 0.9, 0.9)), ('grain', 20)],
+    # 云梦 - 轻度模糊，淡雅灰色调
+    'cloudy_dream': [('blur', 1.2), ('brightness', 1.0), ('color', 0.6), ('channels', (0.95, 0.95, 0.95)), ('grain', 18)],
+    # 雾忆 - 中度模糊，怀旧灰色调
+    'foggy_memory': [('blur', 1.8), ('brightness', 0.85), ('color', 0.4), ('channels', (0.85, 0.85, 0.85)), ('grain', 25)],
+    # 银雾 - 轻微模糊，银色灰色调
+    'silver_mist': [('blur', 1.0), ('brightness', 0.95), ('color', 0.7), ('channels', (1.0, 1.0, 1.0)), ('grain', 15)],
+    # 尘封胶片 - 中度模糊，复古灰色调
+    'dusty_film': [('blur', 1.6), ('brightness', 0.8), ('color', 0.5), ('channels', (0.9, 0.9, 0.9)), ('grain', 28)],
+    # 朦胧夜 - 轻度模糊，夜晚灰色调
+    'hazy_night': [('blur', 1.3), ('brightness', 0.7), ('color', 0.6), ('channels', (0.95, 0.95, 0.95)), ('grain', 22)],
+    # 柔焦 - 轻微模糊，柔和灰色调
+    'soft_focus': [('blur', 1.1), ('brightness', 1.0), ('color', 0.7), ('channels', (1.0, 1.0, 1.0)), ('grain', 16)],
+    # 复古模糊 - 中度模糊，老照片灰色调
+    'vintage_blur': [('blur', 1.7), ('brightness', 0.85), ('color', 0.4), ('channels', (0.85, 0.85, 0.85)), ('grain', 26)],
+
+    # 新增9个爆款Y2K风格滤镜
+    # 霓虹发光 - Basic类别，高亮度高对比度，霓虹灯效果
+    'neon_glow': [('brightness', 1.3), ('contrast', 1.4), ('color', 1.6), ('channels', (1.2, 1.1, 1.3)), ('grain', 25)],
+    # 赛博复古 - Basic类别，冷色调，未来复古感
+    'cyber_retro': [('contrast', 1.3), ('color', 1.2), ('channels', (0.9, 1.1, 1.2)), ('grain', 35)],
+    # 合成波 - Basic类别，粉紫色调，80年代电子音乐风格
+    'synthwave': [('color', 1.7), ('brightness', 1.1), ('channels', (1.3, 0.9, 1.4)), ('grain', 30)],
+    # 深褐色复古 - Vintage类别，深褐色调，增加颗粒感
+    'sepia_dust': [('color', 0.6), ('brightness', 0.8), ('channels', (0.7, 0.6, 0.5)), ('grain', 45)],
+    # 宝丽来褪色 - Vintage类别，降低饱和度，淡黄色调
+    'polaroid_fade': [('color', 0.7), ('brightness', 1.05), ('channels', (1.1, 1.05, 0.9)), ('grain', 32)],
+    # 金属光泽 - Y2K类别，增加金属光泽和高光
+    'chrome_shine': [('contrast', 1.5), ('brightness', 1.2), ('color', 1.3), ('channels', (1.1, 1.1, 1.1)), ('sharpen', None), ('grain', 20)],
+    # 泡泡流行 - Y2K类别，明亮色彩，高对比度
+    'bubble_pop': [('color', 1.8), ('brightness', 1.15), ('contrast', 1.3), ('channels', (1.2, 1.1, 1.3)), ('grain', 28)],
+    # 故障艺术 - Special Effects类别，模拟数字信号干扰（红色通道左移，蓝色通道右移）
+    'glitch_art': [('contrast', 1.6), ('brightness', 0.9), ('shift', (-8, 0, 8)), ('grain', 55)],
+    # 全息图 - Special Effects类别，彩虹色调和光斑效果
+    'holographic': [('color', 2.0), ('brightness', 1.1), ('contrast', 1.4), ('channels', (1.3, 1.2, 1.4)), ('shift', (0, -3, 0)), ('grain', 40)],
+
+    # 新增10个爆款Y2K风格滤镜
+    # 电蓝色调 - Basic类别，高对比度蓝色调
+    'electric_blue': [('contrast', 1.5), ('color', 1.4), ('channels', (0.7, 1.1, 1.4)), ('grain', 30)],
+    # 霓虹粉色 - Basic类别，高饱和度粉色调
+    'neon_pink': [('color', 1.8), ('brightness', 1.2), ('channels', (1.4, 0.8, 1.2)), ('grain', 35)],
+    # 赛博绿色 - Basic类别，科技感绿色调
+    'cyber_green': [('contrast', 1.4), ('color', 1.3), ('channels', (0.6, 1.3, 0.8)), ('grain', 32)],
+    # 复古橙色 - Basic类别，温暖橙色调
+    'retro_orange': [('brightness', 1.1), ('color', 1.2), ('channels', (1.3, 1.1, 0.7)), ('grain', 28)],
+    # 胶片颗粒 - Vintage类别，复古胶片质感
+    'film_grain': [('color', 0.8), ('brightness', 0.9), ('channels', (0.9, 0.85, 0.8)), ('grain', 50)],
+    # 老化纸张 - Vintage类别，怀旧纸张效果
+    'aged_paper': [('color', 0.7), ('brightness', 1.05), ('channels', (1.1, 1.05, 0.9)), ('grain', 45)],
+    # 金属银色 - Y2K类别，未来感银色调
+    'metallic_silver': [('contrast', 1.6), ('brightness', 1.1), ('color', 0.6), ('channels', (1.0, 1.0, 1.0)), ('grain', 25)],
+    # 霓虹青色 - Y2K类别，Y2K风格青色调
+    'neon_cyan': [('color', 1.7), ('brightness', 1.15), ('contrast', 1.3), ('channels', (0.8, 1.2, 1.3)), ('grain', 30)],
+    # 数字噪点 - Special Effects类别，故障噪点效果
+    'digital_noise': [('contrast', 1.7), ('brightness', 0.95), ('shift', (-6, 0, 6)), ('grain', 60)],
+    # 彩虹偏移 - Special Effects类别，全息彩虹效果
+    'rainbow_shift': [('color', 2.2), ('brightness', 1.1), ('contrast', 1.5), ('channels', (1.4, 1.3, 1.5)), ('shift', (-4, 0, 4)), ('grain', 45)],
+}
+
+def shift_channel(channel, offset):
+    """水平偏移单个通道，空出的部分填黑"""
+    if offset == 0:
+        return channel
+    shifted = Image.new('L', channel.size)
+    if offset > 0:
+        shifted.paste(channel.crop((0, 0, channel.width - offset, channel.height)), (offset, 0))
+    else:
+        shifted.paste(channel.crop((-offset, 0, channel.width, channel.height)), (0, 0))
+    return shifted
+
+def contrast_mean(img):
+    """对比度调整的中心：整张图的平均亮度（与 ImageEnhance.Contrast 一致）"""
+    return int(ImageStat.Stat(img.convert('L')).mean[0] + 0.5)
+
+def apply_step(img, step, rng=None, mean=None):
+    """执行单个滤镜步骤；mean 为整图平均亮度，分条带处理对比度时传入"""
+    op, value = step
+    if op == 'brightness':
+        return ImageEnhance.Brightness(img).enhance(value)
+    if op == 'color':
+        return ImageEnhance.Color(img).enhance(value)
+    if op == 'contrast':
+        if mean is None:
+            return ImageEnhance.Contrast(img).enhance(value)
+        return Image.blend(Image.new('RGB', img.size, (mean, mean, mean)), img, value)
+    if op == 'blur':
+        return img.filter(ImageFilter.GaussianBlur(radius=value))
+    if op == 'sharpen':
+        return img.filter(ImageFilter.SHARPEN)
+    if op == 'channels':
+        return Image.merge("RGB", [
+            band.point(lambda i, m=m: i*m) for band, m in zip(img.split(), value)
+        ])
+    if op == 'shift':
+        return Image.merge("RGB", [
+            shift_channel(band, offset) for band, offset in zip(img.split(), value)
+        ])
+    if op == 'grain':
+        return add_grain_pure_pil(img, intensity=value, rng=rng)
+    raise ValueError(f"Unknown filter step: {op}")
+
+def step_overlap(step):
+    """邻域类步骤在条带边界需要额外读取的行数"""
+    op, value = step
+    if op == 'blur':
+        return math.ceil(value * 3) + 3
+    if op == 'sharpen':
+        return 1
+    return 0
+
+def filter_threads(pixels):
+    """根据图片大小和当前负载决定并行线程数，只在有空闲核心时并行"""
+    if _band_executor is None or pixels < PARALLEL_MIN_PIXELS:
+        return 1
+    try:
+        busy = math.ceil(os.getloadavg()[0])
+    except (AttributeError, OSError):
+        busy = 0
+    free = (os.cpu_count() or 1) - busy
+    return max(1, min(FILTER_THREADS, free))
+
+def apply_step_banded(img, step, rng, threads, cpu_ms=None):
+    """把图片按固定高度切成条带并行执行单个步骤
+
+    模糊/锐化按 step_overlap 多读相邻行，拼接后与整图处理结果一致；
+    噪点每个条带使用独立的随机种子，种子按条带顺序从 rng 取出，
+    结果只取决于 seed，与线程数和调度顺序无关。
+    cpu_ms 为列表时追加条带线程消耗的CPU时间（毫秒），供成本模型统计
+    """
+    width, height = img.size
+    tops = list(range(0, height, BAND_HEIGHT))
+    if step[0] == 'grain':
+        band_rngs = [random.Random(rng.getrandbits(64)) for _ in tops]
+    else:
+        band_rngs = [None] * len(tops)
+    mean = contrast_mean(img) if step[0] == 'contrast' else None
+    overlap = step_overlap(step)
+    
+    def run(index):
+        top = tops[index]
+        bottom = min(height, top + BAND_HEIGHT)
+        crop_top = max(0, top - overlap)
+        band = img.crop((0, crop_top, width, min(height, bottom + overlap)))
+        band = apply_step(band, step, band_rngs[index], mean)
+        return band.crop((0, top - crop_top, width, bottom - crop_top))
+    
+    def run_timed(index):
+        start = time.thread_time()
+        band = run(index)
+        if cpu_ms is not None:
+            cpu_ms.append((time.thread_time() - start) * 1000)
+        return band
+    
+    if threads > 1 and _band_executor is not None:
+        bands = list(_band_executor.map(run_timed, range(len(tops))))
+    else:
+        bands = [run(index) for index in range(len(tops))]
+    if len(bands) == 1:
+        return bands[0]
+    result = Image.new('RGB', img.size)
+    for top, band in zip(tops, bands):
+        result.paste(band, (0, top))
+    return result
+
+def _channel_lut(multiplier):
+    """用 Pillow 实际计算出通道查找表，保证与服务端结果一致"""
+    gradient = Image.new('L', (256, 1))
+    gradient.putdata(range(256))
+    return bytes(gradient.point(lambda i: i*multiplier).getdata())
+
+def _color_matrix(op, value):
+    """Brightness/Color 调整对应的 3x4 颜色矩阵（行优先，最后一列为常数项）"""
+    if op == 'brightness':
+        return [value, 0, 0, 0, 0, value, 0, 0, 0, 0, value, 0]
+    # Color 是原图与灰度图（ITU-R 601-2 亮度）之间的插值
+    gray = (0.299 * (1 - value), 0.587 * (1 - value), 0.114 * (1 - value))
+    matrix = []
+    for c in range(3):
+        row = list(gray)
+        row[c] += value
+        matrix.extend(row + [0])
+    return [round(v, 6) for v in matrix]
+
+def export_step(step):
+    """将滤镜步骤导出为前端可直接执行的 JSON 结构"""
+    op, value = step
+    if op in ('brightness', 'color'):
+        return {'op': 'matrix', 'matrix': _color_matrix(op, value)}
+    if op == 'contrast':
+        # 对比度以整张图的平均亮度为中心，由前端计算平均值
+        return {'op': 'contrast', 'factor': value}
+    if op == 'blur':
+        return {'op': 'blur', 'radius': value}
+    if op == 'sharpen':
+        size, scale, offset, kernel = ImageFilter.SHARPEN.filterargs
+        return {'op': 'convolve', 'size': size[0], 'scale': scale, 'offset': offset, 'kernel': list(kernel)}
+    if op == 'channels':
+        return {'op': 'lut', 'lut': [base64.b64encode(_channel_lut(m)).decode('ascii') for m in value]}
+    if op == 'shift':
+        return {'op': 'shift', 'offsets': list(value)}
+    if op == 'grain':
+        return {'op': 'grain', 'intensity': value}
+    raise ValueError(f"Unknown filter step: {op}")
+
+def export_filter_definitions():
+    """导出全部滤镜定义，供前端在 canvas 上渲染即时预览"""
+    return {
+        name: {'pixelate': PIXELATE_FACTOR, 'steps': [export_step(step) for step in steps]}
+        for name, steps in FILTER_STEPS.items()
+    }
+
+def output_format(input_format):
+    """根据原始格式选择输出格式：无损格式输出PNG，其余输出JPEG"""
+    return 'PNG' if input_format in ['PNG', 'BMP', 'TIFF'] else 'JPEG'
+
+def encode_image(img, input_format, fast_encode=False):
+    """编码输出图片；fast_encode 在高负载时降低编码开销"""
+    img_io = io.BytesIO()
+    if output_format(input_format) == 'PNG':
+        if fast_encode:
+            img.save(img_io, format='PNG', compress_level=1)
+        else:
+            img.save(img_io, format='PNG', optimize=True)
+    else:
+        if fast_encode:
+            img.save(img_io, format='JPEG', quality=85)
+        else:
+            img.save(img_io, format='JPEG', quality=90, optimize=True)
+    return img_io.getvalue()
+
+def apply_filter(image_data, filter_name, seed=None, max_pixels=None, fast_encode=False, stage=None, band_cpu_ms=None, parallel=True):
+    """直接在内存中处理图片，不保存文件
+
+    seed 不为空时噪点可复现：相同输入和 seed 产生完全相同的输出
+    max_pixels / fast_encode 用于高负载时降级：降低工作分辨率和编码开销
+    stage 为性能分析回调，每完成一个处理阶段以阶段名调用一次
+    band_cpu_ms 为列表时追加并行条带在其他线程中消耗的CPU时间（毫秒）
+    parallel 为 False 时所有步骤都在调用线程执行（cProfile 只能分析调用线程）
+    """
+    rng = random.Random(seed)
+    stage = stage or (lambda name: None)
     try:
         # 验证图片
         is_valid, message = validate_image(image_data)
         if not is_valid:
             raise ValueError(message)
         
-        # 打开图片
-        img = Image.open(io.BytesIO(image_data))
-        original_format = img.format
+        # 打开图片（超过工作尺寸时在解码阶段缩小）
+        img, original_format = open_scaled(image_data, max_pixels)
         
         # 转换为RGB模式（处理RGBA、P等模式）
         if img.mode != 'RGB':
             img = img.convert('RGB')
-        
-        # 智能缩放（如果需要）
-        img, was_resized = smart_resize(img)
+        stage('decode')
         
         # 古早像素缩放（保持2000s风格）
         original_size = img.size
-        img = img.resize((img.width//2, img.height//2), Image.NEAREST)
+        img = img.resize((img.width//PIXELATE_FACTOR, img.height//PIXELATE_FACTOR), Image.NEAREST)
         img = img.resize(original_size, Image.NEAREST)
+        stage('pixelate')
 
-        # 过滤器列表
-        if filter_name == 'vintage':
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i:i*1.1),
-                g.point(lambda i:i*1.05),
-                b.point(lambda i:i*0.9)
-            ))
-            img = add_grain_pure_pil(img, intensity=30)
-
-        elif filter_name == 'ccd':
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i:i*0.8),
-                g.point(lambda i:i*0.85),
-                b.point(lambda i:i*1.15)
-            ))
-            img = add_grain_pure_pil(img, intensity=35)
-
-        elif filter_name == 'kodachrome':
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i:i*1.05),
-                g.point(lambda i:i*0.95),
-                b.point(lambda i:i*1.0)
-            ))
-            img = add_grain_pure_pil(img, intensity=28)
-
-        elif filter_name == 'fuji_superia':
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i:i*0.95),
-                g.point(lambda i:i*1.0),
-                b.point(lambda i:i*0.9)
-            ))
-            img = add_grain_pure_pil(img, intensity=28)
-
-        elif filter_name == 'agfa':
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i:i*0.9),
-                g.point(lambda i:i*0.95),
-                b.point(lambda i:i*1.0)
-            ))
-            img = add_grain_pure_pil(img, intensity=30)
-        
-        elif filter_name == 'retro_green': 
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i:i*0.85),
-                g.point(lambda i:i*0.9),
-                b.point(lambda i:i*0.85)
-            ))
-            img = add_grain_pure_pil(img, intensity=28)
-
-        elif filter_name == 'dark_brown': 
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i:i*0.7),
-                g.point(lambda i:i*0.65),
-                b.point(lambda i:i*0.6)
-            ))
-            img = ImageEnhance.Color(img).enhance(0.8)
-            img = add_grain_pure_pil(img, intensity=32)
-            
-        elif filter_name == 'lomo':
-            img = ImageEnhance.Color(img).enhance(1.5)
-            img = ImageEnhance.Contrast(img).enhance(1.2)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.05),
-                g.point(lambda i: i*1.1),
-                b.point(lambda i: i*0.9)
-            ))
-            img = add_grain_pure_pil(img, intensity=35)
-            
-        elif filter_name == 'dreamy':
-            img = ImageEnhance.Brightness(img).enhance(1.1)
-            img = img.filter(ImageFilter.GaussianBlur(radius=1.5))
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i:i*1.1),
-                g.point(lambda i:i*1.1),
-                b.point(lambda i:i*1.05)
-            ))
-            img = add_grain_pure_pil(img, intensity=30)
-            
-        elif filter_name == 'vhs':
-            img = ImageEnhance.Brightness(img).enhance(0.9)
-            img = ImageEnhance.Contrast(img).enhance(1.1)
-            r, g, b = img.split()
-            r = r.point(lambda i: i * 1.05)
-            b = b.point(lambda i: i * 0.95)
-            img = Image.merge("RGB", (r, g, b))
-            img = add_grain_pure_pil(img, intensity=40)
-
-        # 新增滤镜
-        elif filter_name == 'vaporwave':
-            img = ImageEnhance.Color(img).enhance(1.8)
-            img = ImageEnhance.Brightness(img).enhance(1.1)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.1),
-                g.point(lambda i: i*1.2),
-                b.point(lambda i: i*1.5)
-            ))
-            img = add_grain_pure_pil(img, intensity=45)
-
-        elif filter_name == 'glitch':
-            img = ImageEnhance.Contrast(img).enhance(1.3)
-            img = ImageEnhance.Brightness(img).enhance(0.9)
-            
-            offset = 5
-            r, g, b = img.split()
-            new_g = g.crop((offset, 0, img.width, img.height))
-            new_b = b.crop((0, 0, img.width - offset, img.height))
-            
-            r_img = Image.new('L', img.size)
-            r_img.paste(r, (0, 0))
-            
-            g_img = Image.new('L', img.size)
-            g_img.paste(new_g, (0, 0))
-            
-            b_img = Image.new('L', img.size)
-            b_img.paste(new_b, (offset, 0))
-            
-            img = Image.merge("RGB", (r_img, g_img, b_img))
-            img = add_grain_pure_pil(img, intensity=50)
-
-        elif filter_name == 'y2k':
-            img = ImageEnhance.Color(img).enhance(1.4)
-            img = ImageEnhance.Contrast(img).enhance(1.2)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.1),
-                g.point(lambda i: i*1.0),
-                b.point(lambda i: i*1.1)
-            ))
-            img = img.filter(ImageFilter.SHARPEN)
-            img = add_grain_pure_pil(img, intensity=30)
-
-        # 新增10个2000s风格滤镜
-        elif filter_name == 'cyberpunk':
-            # 赛博朋克风格 - 高对比度，蓝紫色调
-            img = ImageEnhance.Contrast(img).enhance(1.4)
-            img = ImageEnhance.Color(img).enhance(1.3)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*0.8),
-                g.point(lambda i: i*1.1),
-                b.point(lambda i: i*1.3)
-            ))
-            img = add_grain_pure_pil(img, intensity=40)
-
-        elif filter_name == 'neon_pop':
-            # 霓虹流行 - 高饱和度，粉紫色调
-            img = ImageEnhance.Color(img).enhance(1.8)
-            img = ImageEnhance.Brightness(img).enhance(1.1)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.2),
-                g.point(lambda i: i*1.0),
-                b.point(lambda i: i*1.4)
-            ))
-            img = add_grain_pure_pil(img, intensity=35)
-
-        elif filter_name == 'digital_cam':
-            # 早期数码相机 - 低饱和度，偏绿
-            img = ImageEnhance.Color(img).enhance(0.7)
-            img = ImageEnhance.Contrast(img).enhance(1.1)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*0.9),
-                g.point(lambda i: i*1.1),
-                b.point(lambda i: i*0.8)
-            ))
-            img = add_grain_pure_pil(img, intensity=45)
-
-        elif filter_name == 'cyber_pink':
-            # 赛博粉 - 粉色调，高对比度
-            img = ImageEnhance.Contrast(img).enhance(1.3)
-            img = ImageEnhance.Color(img).enhance(1.5)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.3),
-                g.point(lambda i: i*0.9),
-                b.point(lambda i: i*1.1)
-            ))
-            img = add_grain_pure_pil(img, intensity=30)
-
-        elif filter_name == 'retro_blue':
-            # 复古蓝 - 蓝色调，低亮度
-            img = ImageEnhance.Brightness(img).enhance(0.8)
-            img = ImageEnhance.Contrast(img).enhance(1.2)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*0.7),
-                g.point(lambda i: i*0.9),
-                b.point(lambda i: i*1.2)
-            ))
-            img = add_grain_pure_pil(img, intensity=38)
-
-        elif filter_name == 'millennium_gold':
-            # 千禧金 - 金色调，温暖感
-            img = ImageEnhance.Brightness(img).enhance(1.1)
-            img = ImageEnhance.Color(img).enhance(1.2)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.2),
-                g.point(lambda i: i*1.1),
-                b.point(lambda i: i*0.8)
-            ))
-            img = add_grain_pure_pil(img, intensity=32)
-
-        elif filter_name == 'matrix_green':
-            # 矩阵绿 - 绿色调，电影感
-            img = ImageEnhance.Contrast(img).enhance(1.3)
-            img = ImageEnhance.Brightness(img).enhance(0.9)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*0.6),
-                g.point(lambda i: i*1.2),
-                b.point(lambda i: i*0.7)
-            ))
-            img = add_grain_pure_pil(img, intensity=42)
-
-        elif filter_name == 'disco_fever':
-            # 迪斯科狂热 - 高饱和度，紫红色调
-            img = ImageEnhance.Color(img).enhance(1.6)
-            img = ImageEnhance.Brightness(img).enhance(1.05)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.3),
-                g.point(lambda i: i*0.8),
-                b.point(lambda i: i*1.2)
-            ))
-            img = add_grain_pure_pil(img, intensity=35)
-
-        elif filter_name == 'tech_silver':
-            # 科技银 - 银色调，冷感
-            img = ImageEnhance.Contrast(img).enhance(1.2)
-            img = ImageEnhance.Brightness(img).enhance(0.95)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*0.9),
-                g.point(lambda i: i*0.95),
-                b.point(lambda i: i*1.0)
-            ))
-            img = ImageEnhance.Color(img).enhance(0.8)
-            img = add_grain_pure_pil(img, intensity=40)
-
-        elif filter_name == 'y2k_purple':
-            # Y2K紫 - 紫色调，未来感
-            img = ImageEnhance.Color(img).enhance(1.4)
-            img = ImageEnhance.Contrast(img).enhance(1.25)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.1),
-                g.point(lambda i: i*0.8),
-                b.point(lambda i: i*1.3)
-            ))
-            img = add_grain_pure_pil(img, intensity=33)
-
-        # 新增8个更清晰、灰色调的Y2K风格滤镜
-        elif filter_name == 'misty_gray':
-            # 迷雾灰 - 轻微模糊，柔和灰色调
-            img = img.filter(ImageFilter.GaussianBlur(radius=1.5))
-            img = ImageEnhance.Brightness(img).enhance(0.9)
-            img = ImageEnhance.Color(img).enhance(0.5)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*0.9),
-                g.point(lambda i: i*0.9),
-                b.point(lambda i: i*0.9)
-            ))
-            img = add_grain_pure_pil(img, intensity=20)
-
-        elif filter_name == 'cloudy_dream':
-            # 云梦 - 轻度模糊，淡雅灰色调
-            img = img.filter(ImageFilter.GaussianBlur(radius=1.2))
-            img = ImageEnhance.Brightness(img).enhance(1.0)
-            img = ImageEnhance.Color(img).enhance(0.6)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*0.95),
-                g.point(lambda i: i*0.95),
-                b.point(lambda i: i*0.95)
-            ))
-            img = add_grain_pure_pil(img, intensity=18)
-
-        elif filter_name == 'foggy_memory':
-            # 雾忆 - 中度模糊，怀旧灰色调
-            img = img.filter(ImageFilter.GaussianBlur(radius=1.8))
-            img = ImageEnhance.Brightness(img).enhance(0.85)
-            img = ImageEnhance.Color(img).enhance(0.4)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*0.85),
-                g.point(lambda i: i*0.85),
-                b.point(lambda i: i*0.85)
-            ))
-            img = add_grain_pure_pil(img, intensity=25)
-
-        elif filter_name == 'silver_mist':
-            # 银雾 - 轻微模糊，银色灰色调
-            img = img.filter(ImageFilter.GaussianBlur(radius=1.0))
-            img = ImageEnhance.Brightness(img).enhance(0.95)
-            img = ImageEnhance.Color(img).enhance(0.7)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.0),
-                g.point(lambda i: i*1.0),
-                b.point(lambda i: i*1.0)
-            ))
-            img = add_grain_pure_pil(img, intensity=15)
-
-        elif filter_name == 'dusty_film':
-            # 尘封胶片 - 中度模糊，复古灰色调
-            img = img.filter(ImageFilter.GaussianBlur(radius=1.6))
-            img = ImageEnhance.Brightness(img).enhance(0.8)
-            img = ImageEnhance.Color(img).enhance(0.5)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*0.9),
-                g.point(lambda i: i*0.9),
-                b.point(lambda i: i*0.9)
-            ))
-            img = add_grain_pure_pil(img, intensity=28)
-
-        elif filter_name == 'hazy_night':
-            # 朦胧夜 - 轻度模糊，夜晚灰色调
-            img = img.filter(ImageFilter.GaussianBlur(radius=1.3))
-            img = ImageEnhance.Brightness(img).enhance(0.7)
-            img = ImageEnhance.Color(img).enhance(0.6)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*0.95),
-                g.point(lambda i: i*0.95),
-                b.point(lambda i: i*0.95)
-            ))
-            img = add_grain_pure_pil(img, intensity=22)
-
-        elif filter_name == 'soft_focus':
-            # 柔焦 - 轻微模糊，柔和灰色调
-            img = img.filter(ImageFilter.GaussianBlur(radius=1.1))
-            img = ImageEnhance.Brightness(img).enhance(1.0)
-            img = ImageEnhance.Color(img).enhance(0.7)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.0),
-                g.point(lambda i: i*1.0),
-                b.point(lambda i: i*1.0)
-            ))
-            img = add_grain_pure_pil(img, intensity=16)
-
-        elif filter_name == 'vintage_blur':
-            # 复古模糊 - 中度模糊，老照片灰色调
-            img = img.filter(ImageFilter.GaussianBlur(radius=1.7))
-            img = ImageEnhance.Brightness(img).enhance(0.85)
-            img = ImageEnhance.Color(img).enhance(0.4)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*0.85),
-                g.point(lambda i: i*0.85),
-                b.point(lambda i: i*0.85)
-            ))
-            img = add_grain_pure_pil(img, intensity=26)
-
-        # 新增9个爆款Y2K风格滤镜
-        elif filter_name == 'neon_glow':
-            # 霓虹发光 - Basic类别，高亮度高对比度，霓虹灯效果
-            img = ImageEnhance.Brightness(img).enhance(1.3)
-            img = ImageEnhance.Contrast(img).enhance(1.4)
-            img = ImageEnhance.Color(img).enhance(1.6)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.2),
-                g.point(lambda i: i*1.1),
-                b.point(lambda i: i*1.3)
-            ))
-            img = add_grain_pure_pil(img, intensity=25)
-
-        elif filter_name == 'cyber_retro':
-            # 赛博复古 - Basic类别，冷色调，未来复古感
-            img = ImageEnhance.Contrast(img).enhance(1.3)
-            img = ImageEnhance.Color(img).enhance(1.2)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*0.9),
-                g.point(lambda i: i*1.1),
-                b.point(lambda i: i*1.2)
-            ))
-            img = add_grain_pure_pil(img, intensity=35)
-
-        elif filter_name == 'synthwave':
-            # 合成波 - Basic类别，粉紫色调，80年代电子音乐风格
-            img = ImageEnhance.Color(img).enhance(1.7)
-            img = ImageEnhance.Brightness(img).enhance(1.1)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.3),
-                g.point(lambda i: i*0.9),
-                b.point(lambda i: i*1.4)
-            ))
-            img = add_grain_pure_pil(img, intensity=30)
-
-        elif filter_name == 'sepia_dust':
-            # 深褐色复古 - Vintage类别，深褐色调，增加颗粒感
-            img = ImageEnhance.Color(img).enhance(0.6)
-            img = ImageEnhance.Brightness(img).enhance(0.8)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*0.7),
-                g.point(lambda i: i*0.6),
-                b.point(lambda i: i*0.5)
-            ))
-            img = add_grain_pure_pil(img, intensity=45)
-
-        elif filter_name == 'polaroid_fade':
-            # 宝丽来褪色 - Vintage类别，降低饱和度，淡黄色调
-            img = ImageEnhance.Color(img).enhance(0.7)
-            img = ImageEnhance.Brightness(img).enhance(1.05)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.1),
-                g.point(lambda i: i*1.05),
-                b.point(lambda i: i*0.9)
-            ))
-            img = add_grain_pure_pil(img, intensity=32)
-
-        elif filter_name == 'chrome_shine':
-            # 金属光泽 - Y2K类别，增加金属光泽和高光
-            img = ImageEnhance.Contrast(img).enhance(1.5)
-            img = ImageEnhance.Brightness(img).enhance(1.2)
-            img = ImageEnhance.Color(img).enhance(1.3)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.1),
-                g.point(lambda i: i*1.1),
-                b.point(lambda i: i*1.1)
-            ))
-            img = img.filter(ImageFilter.SHARPEN)
-            img = add_grain_pure_pil(img, intensity=20)
-
-        elif filter_name == 'bubble_pop':
-            # 泡泡流行 - Y2K类别，明亮色彩，高对比度
-            img = ImageEnhance.Color(img).enhance(1.8)
-            img = ImageEnhance.Brightness(img).enhance(1.15)
-            img = ImageEnhance.Contrast(img).enhance(1.3)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.2),
-                g.point(lambda i: i*1.1),
-                b.point(lambda i: i*1.3)
-            ))
-            img = add_grain_pure_pil(img, intensity=28)
-
-        elif filter_name == 'glitch_art':
-            # 故障艺术 - Special Effects类别，模拟数字信号干扰
-            img = ImageEnhance.Contrast(img).enhance(1.6)
-            img = ImageEnhance.Brightness(img).enhance(0.9)
-            
-            # 创建RGB通道偏移效果
-            offset = 8
-            r, g, b = img.split()
-            
-            # 红色通道向右偏移
-            new_r = r.crop((offset, 0, img.width, img.height))
-            r_img = Image.new('L', img.size)
-            r_img.paste(new_r, (0, 0))
-            
-            # 蓝色通道向左偏移
-            new_b = b.crop((0, 0, img.width - offset, img.height))
-            b_img = Image.new('L', img.size)
-            b_img.paste(new_b, (offset, 0))
-            
-            img = Image.merge("RGB", (r_img, g, b_img))
-            img = add_grain_pure_pil(img, intensity=55)
-
-        elif filter_name == 'holographic':
-            # 全息图 - Special Effects类别，彩虹色调和光斑效果
-            img = ImageEnhance.Color(img).enhance(2.0)
-            img = ImageEnhance.Brightness(img).enhance(1.1)
-            img = ImageEnhance.Contrast(img).enhance(1.4)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.3),
-                g.point(lambda i: i*1.2),
-                b.point(lambda i: i*1.4)
-            ))
-            # 添加彩虹色偏移效果
-            offset = 3
-            r, g, b = img.split()
-            new_g = g.crop((offset, 0, img.width, img.height))
-            g_img = Image.new('L', img.size)
-            g_img.paste(new_g, (0, 0))
-            img = Image.merge("RGB", (r, g_img, b))
-            img = add_grain_pure_pil(img, intensity=40)
-
-        # 新增10个爆款Y2K风格滤镜
-        elif filter_name == 'electric_blue':
-            # 电蓝色调 - Basic类别，高对比度蓝色调
-            img = ImageEnhance.Contrast(img).enhance(1.5)
-            img = ImageEnhance.Color(img).enhance(1.4)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*0.7),
-                g.point(lambda i: i*1.1),
-                b.point(lambda i: i*1.4)
-            ))
-            img = add_grain_pure_pil(img, intensity=30)
-
-        elif filter_name == 'neon_pink':
-            # 霓虹粉色 - Basic类别，高饱和度粉色调
-            img = ImageEnhance.Color(img).enhance(1.8)
-            img = ImageEnhance.Brightness(img).enhance(1.2)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.4),
-                g.point(lambda i: i*0.8),
-                b.point(lambda i: i*1.2)
-            ))
-            img = add_grain_pure_pil(img, intensity=35)
-
-        elif filter_name == 'cyber_green':
-            # 赛博绿色 - Basic类别，科技感绿色调
-            img = ImageEnhance.Contrast(img).enhance(1.4)
-            img = ImageEnhance.Color(img).enhance(1.3)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*0.6),
-                g.point(lambda i: i*1.3),
-                b.point(lambda i: i*0.8)
-            ))
-            img = add_grain_pure_pil(img, intensity=32)
-
-        elif filter_name == 'retro_orange':
-            # 复古橙色 - Basic类别，温暖橙色调
-            img = ImageEnhance.Brightness(img).enhance(1.1)
-            img = ImageEnhance.Color(img).enhance(1.2)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.3),
-                g.point(lambda i: i*1.1),
-                b.point(lambda i: i*0.7)
-            ))
-            img = add_grain_pure_pil(img, intensity=28)
-
-        elif filter_name == 'film_grain':
-            # 胶片颗粒 - Vintage类别，复古胶片质感
-            img = ImageEnhance.Color(img).enhance(0.8)
-            img = ImageEnhance.Brightness(img).enhance(0.9)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*0.9),
-                g.point(lambda i: i*0.85),
-                b.point(lambda i: i*0.8)
-            ))
-            img = add_grain_pure_pil(img, intensity=50)
-
-        elif filter_name == 'aged_paper':
-            # 老化纸张 - Vintage类别，怀旧纸张效果
-            img = ImageEnhance.Color(img).enhance(0.7)
-            img = ImageEnhance.Brightness(img).enhance(1.05)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.1),
-                g.point(lambda i: i*1.05),
-                b.point(lambda i: i*0.9)
-            ))
-            img = add_grain_pure_pil(img, intensity=45)
-
-        elif filter_name == 'metallic_silver':
-            # 金属银色 - Y2K类别，未来感银色调
-            img = ImageEnhance.Contrast(img).enhance(1.6)
-            img = ImageEnhance.Brightness(img).enhance(1.1)
-            img = ImageEnhance.Color(img).enhance(0.6)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.0),
-                g.point(lambda i: i*1.0),
-                b.point(lambda i: i*1.0)
-            ))
-            img = add_grain_pure_pil(img, intensity=25)
-
-        elif filter_name == 'neon_cyan':
-            # 霓虹青色 - Y2K类别，Y2K风格青色调
-            img = ImageEnhance.Color(img).enhance(1.7)
-            img = ImageEnhance.Brightness(img).enhance(1.15)
-            img = ImageEnhance.Contrast(img).enhance(1.3)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*0.8),
-                g.point(lambda i: i*1.2),
-                b.point(lambda i: i*1.3)
-            ))
-            img = add_grain_pure_pil(img, intensity=30)
-
-        elif filter_name == 'digital_noise':
-            # 数字噪点 - Special Effects类别，故障噪点效果
-            img = ImageEnhance.Contrast(img).enhance(1.7)
-            img = ImageEnhance.Brightness(img).enhance(0.95)
-            
-            # 创建数字噪点效果
-            offset = 6
-            r, g, b = img.split()
-            
-            # 红色通道向右偏移
-            new_r = r.crop((offset, 0, img.width, img.height))
-            r_img = Image.new('L', img.size)
-            r_img.paste(new_r, (0, 0))
-            
-            # 蓝色通道向左偏移
-            new_b = b.crop((0, 0, img.width - offset, img.height))
-            b_img = Image.new('L', img.size)
-            b_img.paste(new_b, (offset, 0))
-            
-            img = Image.merge("RGB", (r_img, g, b_img))
-            img = add_grain_pure_pil(img, intensity=60)
-
-        elif filter_name == 'rainbow_shift':
-            # 彩虹偏移 - Special Effects类别，全息彩虹效果
-            img = ImageEnhance.Color(img).enhance(2.2)
-            img = ImageEnhance.Brightness(img).enhance(1.1)
-            img = ImageEnhance.Contrast(img).enhance(1.5)
-            r, g, b = img.split()
-            img = Image.merge("RGB", (
-                r.point(lambda i: i*1.4),
-                g.point(lambda i: i*1.3),
-                b.point(lambda i: i*1.5)
-            ))
-            # 添加彩虹色偏移效果
-            offset = 4
-            r, g, b = img.split()
-            new_r = r.crop((offset, 0, img.width, img.height))
-            r_img = Image.new('L', img.size)
-            r_img.paste(new_r, (0, 0))
-            
-            new_b = b.crop((0, 0, img.width - offset, img.height))
-            b_img = Image.new('L', img.size)
-            b_img.paste(new_b, (offset, 0))
-            
-            img = Image.merge("RGB", (r_img, g, b_img))
-            img = add_grain_pure_pil(img, intensity=45)
+        # 按定义依次执行滤镜步骤（大图在有空闲核心时分条带并行）
+        threads = filter_threads(img.width * img.height) if parallel else 1
+        for step in FILTER_STEPS.get(filter_name, []):
+            img = apply_step_banded(img, step, rng, threads, band_cpu_ms)
+            stage(step[0])
         
         # 将处理后的图片转换为字节数据返回，不保存文件
-        img_io = io.BytesIO()
-        
-        # 根据原始格式选择输出格式和质量
-        if original_format in ['PNG', 'BMP', 'TIFF']:
-            img.save(img_io, format='PNG', optimize=True)
-        else:
-            img.save(img_io, format='JPEG', quality=90, optimize=True)
-        
-        img_io.seek(0)
-        return img_io.getvalue()
+        data = encode_image(img, original_format, fast_encode)
+        stage('encode')
+        return data
         
     except ValueError as e:
         # 用户输入错误（文件过大、格式不支持等）
@@ -0,0 +1,295 @@
+"""本地压测工具：在不同 worker 配置下启动应用，模拟真实上传流量并输出性能报告
+
+用法示例：
+    python loadtest.py --configs sync:1:1,sync:2:1,gthread:2:4 --concurrency 8 --duration 60
+
+配置格式为 后端:worker数:线程数，后端可选 gunicorn 的 worker 类型（sync、gthread 等）、
+uvicorn（asgi.py 入口）或 werkzeug（Flask 自带开发服务器，单进程多线程）。全程只访问本机，不需要联网。
+每个虚拟客户端从不同的回环地址（127.0.x.y）发起连接，服务端按来源地址分别限流，
+这依赖 Linux 上整个 127.0.0.0/8 网段都指向本机。
+"""
+import os
+import io
+import sys
+import time
+import json
+import uuid
+import random
+import shutil
+import socket
+import argparse
+import http.client
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from PIL import Image, ImageDraw
+from app import FILTERS
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 上传图片的尺寸分布 ((宽, 高), 权重)：以手机缩略图和中等尺寸为主
+SIZE_MIX = [((640, 480), 45), ((1280, 960), 35), ((1920, 1440), 15), ((2592, 1944), 5)]
+# 上传格式分布 ((格式, 扩展名), 权重)
+FORMAT_MIX = [(('JPEG', 'jpg'), 70), (('PNG', 'png'), 20), (('WEBP', 'webp'), 10)]
+# 热门滤镜权重更高，其余滤镜均匀分布
+POPULAR_FILTERS = {'ccd': 8, 'vintage': 5, 'y2k': 5, 'vhs': 4, 'glitch': 3, 'vaporwave': 3, 'dreamy': 2}
+
+def weighted_choice(rng, items):
+    return rng.choices([value for value, _ in items], weights=[weight for _, weight in items])[0]
+
+def make_image(rng, size, fmt):
+    """生成带渐变、色块和噪点的测试图片，压缩特性接近真实照片"""
+    width, height = size
+    img = Image.linear_gradient('L').resize(size).convert('RGB')
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rng.randrange(width), rng.randrange(height)
+        w, h = rng.randrange(width // 8, width // 2), rng.randrange(height // 8, height // 2)
+        draw.ellipse((x, y, x + w, y + h), fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    noise = Image.effect_noise(size, 24).convert('RGB')
+    img = Image.blend(img, noise, 0.15)
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, **({'quality': 90} if fmt in ('JPEG', 'WEBP') else {}))
+    return buf.getvalue()
+
+def make_payloads(count, seed):
+    """预先生成测试图片池，避免压测过程中生成图片占用CPU"""
+    rng = random.Random(seed)
+    payloads = []
+    for i in range(count):
+        size = weighted_choice(rng, SIZE_MIX)
+        fmt, ext = weighted_choice(rng, FORMAT_MIX)
+        payloads.append((f'upload_{i}.{ext}', make_image(rng, size, fmt)))
+    return payloads
+
+def filter_weights():
+    return [POPULAR_FILTERS.get(name, 1) for name in FILTERS]
+
+def encode_multipart(filename, data, filter_name):
+    boundary = uuid.uuid4().hex
+    body = b''.join([
+        f'--{boundary}\r\nContent-Disposition: form-data; name="filter"\r\n\r\n{filter_name}\r\n'.encode(),
+        f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="{filename}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'.encode(),
+        data,
+        f'\r\n--{boundary}--\r\n'.encode(),
+    ])
+    return body, f'multipart/form-data; boundary={boundary}'
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(backend, workers, threads, port, env):
+    if backend == 'werkzeug':
+        cmd = [sys.executable, '-c', f"from app import app; app.run(host='127.0.0.1', port={port}, threaded={threads > 1})"]
+    elif backend == 'uvicorn':
+        # ASGI 入口，线程数即每个 worker 执行 Flask 应用的线程池大小
+        env = dict(env, ASGI_WORKER_THREADS=str(threads))
+        cmd = [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1', '--port', str(port),
+               '--workers', str(workers)]
+    else:
+        if shutil.which('gunicorn') is None:
+            raise SystemExit('gunicorn is not installed: pip install gunicorn')
+        cmd = ['gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+               '--threads', str(threads), '--worker-class', backend, '--timeout', '300']
+    proc = subprocess.Popen(cmd, cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f'Server exited during startup: {" ".join(cmd)}')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/faq', timeout=2).read()
+            return proc
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    proc.kill()
+    raise SystemExit('Server did not start within 30s')
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+def child_pids(pid):
+    """读取 /proc 获取子进程（gunicorn worker）"""
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # 进程名可能包含空格，从最后一个右括号之后解析
+                fields = f.read().rsplit(')', 1)[1].split()
+            if int(fields[1]) == pid:
+                children.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return children
+
+def rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+class RssSampler(threading.Thread):
+    """后台定时采样每个 worker 的常驻内存，记录峰值"""
+
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            # werkzeug 没有子进程，直接采样主进程
+            for pid in child_pids(self.pid) or [self.pid]:
+                rss = rss_mb(pid)
+                if rss is not None:
+                    self.peak[pid] = max(self.peak.get(pid, 0), rss)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def run_clients(port, payloads, concurrency, duration, seed):
+    """并发客户端持续发送请求，返回 [(耗时秒, 结果)]"""
+    results = []
+    lock = threading.Lock()
+    deadline = time.time() + duration
+    weights = filter_weights()
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        # 每个虚拟客户端绑定不同的回环来源地址，让按客户端限流的行为接近线上
+        source_address = (f'127.0.{index // 250 + 1}.{index % 250 + 1}', 0)
+        while time.time() < deadline:
+            filename, data = rng.choice(payloads)
+            filter_name = rng.choices(FILTERS, weights=weights)[0]
+            body, content_type = encode_multipart(filename, data, filter_name)
+            start = time.perf_counter()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300, source_address=source_address)
+            try:
+                conn.request('POST', '/', body=body, headers={'Content-Type': content_type})
+                resp = conn.getresponse()
+                payload = resp.read()
+                if resp.status == 200:
+                    data = json.loads(payload)
+                    if not data.get('success'):
+                        outcome = 'error'
+                    else:
+                        # 降级处理的结果画质较低，单独统计，避免混入全画质的吞吐量
+                        outcome = 'degraded' if data.get('degraded') else 'ok'
+                else:
+                    outcome = str(resp.status)
+            except (OSError, ValueError, http.client.HTTPException):
+                outcome = 'network'
+            finally:
+                conn.close()
+            with lock:
+                results.append((time.perf_counter() - start, outcome))
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(config, results, elapsed, peak_rss):
+    # 延迟按所有成功返回的请求统计（含降级），吞吐量只计全画质结果
+    latencies = sorted(latency for latency, outcome in results if outcome in ('ok', 'degraded'))
+    outcomes = {}
+    for _, outcome in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    total = len(results)
+    errors = total - outcomes.get('ok', 0) - outcomes.get('degraded', 0)
+    return {
+        'config': config,
+        'requests': total,
+        'throughput': outcomes.get('ok', 0) / elapsed if elapsed else 0,
+        'degraded_rate': outcomes.get('degraded', 0) / total if total else 0,
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99),
+        'error_rate': errors / total if total else 0,
+        'outcomes': outcomes,
+        'rss': sorted(peak_rss.values()),
+    }
+
+def print_report(rows):
+    print()
+    print(f"{'config':<18}{'reqs':>6}{'ok/s':>8}{'p50 s':>8}{'p90 s':>8}{'p99 s':>8}{'degr %':>8}{'err %':>7}  peak RSS per worker (MB) / outcomes")
+    for row in rows:
+        rss = ','.join(f'{v:.0f}' for v in row['rss'])
+        outcomes = ' '.join(f'{k}={v}' for k, v in sorted(row['outcomes'].items()))
+        print(f"{row['config']:<18}{row['requests']:>6}{row['throughput']:>8.2f}{row['p50']:>8.2f}{row['p90']:>8.2f}"
+              f"{row['p99']:>8.2f}{row['degraded_rate'] * 100:>8.1f}{row['error_rate'] * 100:>7.1f}  {rss} / {outcomes}")
+
+def parse_configs(value):
+    configs = []
+    for item in value.split(','):
+        backend, workers, threads = item.split(':')
+        configs.append((backend, int(workers), int(threads)))
+    return configs
+
+def main():
+    parser = argparse.ArgumentParser(description='Local load test for the filter app')
+    parser.add_argument('--configs', default='sync:1:1,sync:2:1,gthread:2:4',
+                        help='comma separated backend:workers:threads (backend: gunicorn worker class, uvicorn or werkzeug)')
+    parser.add_argument('--concurrency', type=int, default=8, help='number of concurrent clients')
+    parser.add_argument('--duration', type=float, default=60, help='seconds to run each configuration')
+    parser.add_argument('--pool', type=int, default=100, help='number of distinct test images')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-admission', action='store_true', help='disable admission control in the server')
+    args = parser.parse_args()
+
+    print(f'Generating {args.pool} test images...')
+    payloads = make_payloads(args.pool, args.seed)
+    rows = []
+    for backend, workers, threads in parse_configs(args.configs):
+        config = f'{backend}:{workers}:{threads}'
+        # 每个配置使用独立的结果缓存目录，避免上一轮的缓存命中影响结果
+        cache_dir = tempfile.mkdtemp(prefix='loadtest-results-')
+        # WEB_CONCURRENCY 让准入控制按实际 worker 数估算排队时间
+        env = dict(os.environ, RESULT_CACHE_DIR=cache_dir, WEB_CONCURRENCY=str(workers))
+        if args.no_admission:
+            env['ADMISSION_ENABLED'] = '0'
+        port = free_port()
+        print(f'Running {config} for {args.duration:.0f}s with {args.concurrency} clients...')
+        proc = start_server(backend, workers, threads, port, env)
+        sampler = RssSampler(proc.pid)
+        sampler.start()
+        try:
+            start = time.time()
+            results = run_clients(port, payloads, args.concurrency, args.duration, args.seed)
+            elapsed = time.time() - start
+        finally:
+            sampler.stop()
+            stop_server(proc)
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        rows.append(summarize(config, results, elapsed, sampler.peak))
+    print_report(rows)
+
+if __name__ == '__main__':
+    main()
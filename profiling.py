@@ -0,0 +1,202 @@
+"""按需性能分析：针对单个请求采集 cProfile 或分阶段的耗时/内存记录
+
+触发方式（任选其一）：
+- 请求头 X-Profile-Token 携带签名令牌（python profiling.py 生成，5分钟内有效）
+- 管理开关：POST /admin/profiling 在一段时间内分析所有请求
+- 按比例抽样：环境变量 PROFILE_SAMPLE_RATE
+
+分析结果写入 PROFILE_DIR，只保留最近 PROFILE_MAX_FILES 个文件。
+"""
+import os
+import json
+import time
+import hmac
+import uuid
+import random
+import hashlib
+import cProfile
+import tempfile
+import threading
+import tracemalloc
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), '2000s-filter-profiles'))
+PROFILE_SECRET = os.environ.get('PROFILE_SECRET', '')  # 为空时禁用请求头触发和管理接口
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))  # 0~1，按比例抽样分析
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 50))
+PROFILE_TOKEN_MAX_AGE = 300  # 签名令牌有效期（秒）
+PROFILE_MODES = ('cprofile', 'tracemalloc')
+PROFILE_TOGGLE_FILE = os.path.join(PROFILE_DIR, 'enabled.json')  # 管理开关，所有 worker 共享
+
+# cProfile 和 tracemalloc 都是进程级的，同一时间只分析一个请求
+_capture_lock = threading.Lock()
+# 当前线程正在进行的分析模式
+_active = threading.local()
+
+def make_token(now=None):
+    """生成签名令牌：时间戳.HMAC"""
+    timestamp = str(int(now or time.time()))
+    signature = hmac.new(PROFILE_SECRET.encode('utf-8'), timestamp.encode('utf-8'), hashlib.sha256).hexdigest()
+    return f'{timestamp}.{signature}'
+
+def verify_token(token):
+    if not PROFILE_SECRET or not token or '.' not in token:
+        return False
+    timestamp, _ = token.split('.', 1)
+    if not timestamp.isdigit() or abs(time.time() - int(timestamp)) > PROFILE_TOKEN_MAX_AGE:
+        return False
+    return hmac.compare_digest(make_token(int(timestamp)), token)
+
+def set_toggle(minutes, mode='cprofile'):
+    """打开管理开关 minutes 分钟；minutes 为 0 时关闭"""
+    if minutes <= 0:
+        try:
+            os.remove(PROFILE_TOGGLE_FILE)
+        except OSError:
+            pass
+        return None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    state = {'until': time.time() + minutes * 60, 'mode': mode}
+    with open(PROFILE_TOGGLE_FILE, 'w') as f:
+        json.dump(state, f)
+    return state
+
+def get_toggle():
+    try:
+        with open(PROFILE_TOGGLE_FILE) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if state.get('until', 0) > time.time() else None
+
+def requested_mode(headers):
+    """判断当前请求是否需要分析，返回分析模式或 None"""
+    if verify_token(headers.get('X-Profile-Token')):
+        mode = headers.get('X-Profile-Mode', 'cprofile')
+        return mode if mode in PROFILE_MODES else 'cprofile'
+    toggle = get_toggle()
+    if toggle:
+        return toggle.get('mode', 'cprofile')
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return 'cprofile'
+    return None
+
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+class StageTrace:
+    """分阶段记录耗时和内存；apply_filter 每完成一个阶段调用一次 mark"""
+
+    def __init__(self):
+        self.stages = []
+        self.last = time.perf_counter()
+        tracemalloc.reset_peak()
+
+    def mark(self, name):
+        now = time.perf_counter()
+        current, peak = tracemalloc.get_traced_memory()
+        self.stages.append({
+            'stage': name,
+            'ms': round((now - self.last) * 1000, 2),
+            # tracemalloc 只统计 Python 分配，Pillow 的像素内存体现在 RSS 中
+            'python_current_kb': current // 1024,
+            'python_peak_kb': peak // 1024,
+            'rss_mb': _rss_mb(),
+        })
+        tracemalloc.reset_peak()
+        self.last = time.perf_counter()
+
+def _prune():
+    """只保留最新的 PROFILE_MAX_FILES 个分析文件"""
+    entries = list_profiles()
+    for entry in entries[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, entry['name']))
+        except OSError:
+            pass
+
+def _save(mode, filter_name, width, height, image_format, write):
+    """生成带滤镜名、尺寸和格式的文件名，调用 write(路径) 写入"""
+    ext = 'prof' if mode == 'cprofile' else 'json'
+    safe_filter = ''.join(c for c in filter_name if c.isalnum() or c == '_')[:40] or 'unknown'
+    name = f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:6]}-{safe_filter}-{width}x{height}-{image_format or "unknown"}.{ext}'
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        write(os.path.join(PROFILE_DIR, name))
+        _prune()
+        logger.info(f"Profile saved: {name}")
+    except OSError as e:
+        logger.warning(f"Saving profile failed: {e}")
+
+def _write_json(report):
+    def write(path):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return write
+
+@contextmanager
+def capture(mode, filter_name, width, height, image_format):
+    """分析代码块；tracemalloc 模式下产出 stage 回调，其余情况产出 None"""
+    if mode not in PROFILE_MODES or not _capture_lock.acquire(blocking=False):
+        yield None
+        return
+    try:
+        _active.mode = mode
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield None
+            finally:
+                profiler.disable()
+                _active.mode = None
+            # pstats 格式，可用 python -m pstats 或 snakeviz 打开
+            _save(mode, filter_name, width, height, image_format, profiler.dump_stats)
+        else:
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            trace = StageTrace()
+            try:
+                yield trace.mark
+            finally:
+                _active.mode = None
+                if started:
+                    tracemalloc.stop()
+            report = {'filter': filter_name, 'width': width, 'height': height, 'format': image_format,
+                      'total_ms': round(sum(s['ms'] for s in trace.stages), 2), 'stages': trace.stages}
+            _save(mode, filter_name, width, height, image_format, _write_json(report))
+    finally:
+        _capture_lock.release()
+
+def active_mode():
+    """当前线程所在 capture 实际采用的分析模式，未在分析时返回 None
+
+    cProfile 只记录调用线程，分析期间处理代码应留在本线程执行
+    """
+    return getattr(_active, 'mode', None)
+
+def list_profiles():
+    """按时间倒序列出分析文件"""
+    try:
+        with os.scandir(PROFILE_DIR) as it:
+            entries = [
+                {'name': entry.name, 'size': entry.stat().st_size, 'created': entry.stat().st_mtime}
+                for entry in it
+                if entry.is_file() and entry.name.endswith(('.prof', '.json')) and entry.name != os.path.basename(PROFILE_TOGGLE_FILE)
+            ]
+    except OSError:
+        return []
+    return sorted(entries, key=lambda e: e['created'], reverse=True)
+
+if __name__ == '__main__':
+    if not PROFILE_SECRET:
+        raise SystemExit('Set PROFILE_SECRET to generate a profiling token')
+    print(make_token())
@@ -0,0 +1,253 @@
+import os
+import time
+import hashlib
+import tempfile
+import logging
+import threading
+from contextlib import contextmanager
+from filters import FILTER_VERSION
+
+# 跨进程文件锁只在 POSIX 系统上可用
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 结果缓存配置：处理后的图片写入本地目录，所有 gunicorn worker 共享
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', os.path.join(tempfile.gettempdir(), '2000s-filter-results'))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 512 * 1024 * 1024))  # 默认最多占用512MB
+# 结果是用户照片，只临时保留：超过有效期即删除，浏览器缓存时间不超过剩余有效期，且不允许共享缓存/CDN 保存
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 3600))  # 默认保留1小时
+RESULT_LOCK_DIR = os.path.join(RESULT_CACHE_DIR, 'locks')
+RESULT_LOCK_MAX_AGE = 3600  # 超过1小时未使用的锁文件可以清理
+# 无服务器平台（如 Vercel）各实例的临时目录互不共享，/result URL 可能落到没有该文件的实例上；
+# 未配置共享的 RESULT_CACHE_DIR 时默认改为在响应中以 data URL 内联返回结果
+RESULT_INLINE = os.environ.get('RESULT_INLINE', '1' if os.environ.get('VERCEL') and 'RESULT_CACHE_DIR' not in os.environ else '0') == '1'
+
+# 输出格式 -> (扩展名, MIME类型)
+RESULT_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+}
+
+def result_key(image_data, filter_name, **params):
+    """根据原图内容、滤镜名和处理参数计算结果的内容哈希（包含渲染版本号）"""
+    h = hashlib.sha256()
+    h.update(f'v{FILTER_VERSION}'.encode('utf-8'))
+    h.update(hashlib.sha256(image_data).digest())
+    h.update(filter_name.encode('utf-8'))
+    for name in sorted(params):
+        h.update(f'\0{name}={params[name]}'.encode('utf-8'))
+    return h.hexdigest()
+
+def is_result_key(key):
+    """检查是否为合法的结果哈希（防止路径穿越）"""
+    return len(key) == 64 and all(c in '0123456789abcdef' for c in key)
+
+def result_extension(data):
+    """根据图片字节判断扩展名"""
+    return 'png' if data.startswith(b'\x89PNG') else 'jpg'
+
+def _result_path(key, ext):
+    return os.path.join(RESULT_CACHE_DIR, f'{key}.{ext}')
+
+def result_ttl_left(key, ext):
+    """结果剩余的有效秒数，不存在或已过期时返回 None"""
+    try:
+        left = os.stat(_result_path(key, ext)).st_mtime + RESULT_CACHE_TTL - time.time()
+    except OSError:
+        return None
+    return left if left > 0 else None
+
+def touch_result(key, ext):
+    """同一张图片再次上传时重新计算有效期"""
+    try:
+        os.utime(_result_path(key, ext))
+    except OSError:
+        pass
+
+def load_result(key, ext):
+    """读取缓存的结果，不存在或已过期时返回 None"""
+    if ext not in RESULT_TYPES or result_ttl_left(key, ext) is None:
+        return None
+    try:
+        with open(_result_path(key, ext), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+def find_result(key):
+    """查找任意格式且未过期的缓存结果，返回扩展名或 None（只检查文件状态，不读取内容）"""
+    for ext in RESULT_TYPES:
+        if result_ttl_left(key, ext) is not None:
+            return ext
+    return None
+
+def store_result(key, data):
+    """写入结果（原子替换），返回扩展名"""
+    ext = result_extension(data)
+    os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=RESULT_CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, _result_path(key, ext))
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _prune()
+    return ext
+
+def store_alias(key, target):
+    """记录 key 的请求实际得到的是 target 的（降级）结果，有效期与结果相同"""
+    os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=RESULT_CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(target)
+        os.replace(tmp_path, os.path.join(RESULT_CACHE_DIR, f'{key}.alias'))
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def find_alias(key):
+    """查找 store_alias 记录的结果，返回 (结果哈希, 扩展名) 或 None"""
+    path = os.path.join(RESULT_CACHE_DIR, f'{key}.alias')
+    try:
+        if os.stat(path).st_mtime + RESULT_CACHE_TTL < time.time():
+            return None
+        with open(path) as f:
+            target = f.read()
+    except OSError:
+        return None
+    ext = find_result(target) if is_result_key(target) else None
+    return (target, ext) if ext else None
+
+# 正在计算的结果：key -> [线程锁, 等待/持有者数量]
+_flights = {}
+_flights_lock = threading.Lock()
+
+def _lock_path(key):
+    return os.path.join(RESULT_LOCK_DIR, f'{key}.lock')
+
+@contextmanager
+def _file_lock(key):
+    """跨 gunicorn worker 的文件锁"""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(RESULT_LOCK_DIR, exist_ok=True)
+    fd = os.open(_lock_path(key), os.O_CREAT | os.O_RDWR)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.utime(fd)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+@contextmanager
+def result_lock(key):
+    """同一结果同时只计算一次：进程内用线程锁，跨进程用文件锁
+
+    拿到锁后应先再查一次缓存，等待期间其他请求可能已经算好了结果
+    """
+    with _flights_lock:
+        entry = _flights.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            with _file_lock(key):
+                yield
+    finally:
+        with _flights_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _flights[key]
+
+def in_flight(key):
+    """检查是否有其他请求（本进程或其他 worker）正在计算该结果"""
+    with _flights_lock:
+        if key in _flights:
+            return True
+    if fcntl is None:
+        return False
+    try:
+        fd = os.open(_lock_path(key), os.O_RDWR)
+    except OSError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        return False
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+
+def _prune_locks():
+    """清理长时间未使用的锁文件（持有期间会刷新修改时间）"""
+    cutoff = time.time() - RESULT_LOCK_MAX_AGE
+    try:
+        with os.scandir(RESULT_LOCK_DIR) as it:
+            for entry in it:
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+    except OSError:
+        pass
+
+_last_expiry_scan = 0.0
+EXPIRY_SCAN_INTERVAL = 60  # 两次过期清理的最小间隔（秒）
+
+def prune_expired():
+    """删除过期结果；按时间间隔节流，可以在每个请求中调用"""
+    global _last_expiry_scan
+    now = time.time()
+    if now - _last_expiry_scan < EXPIRY_SCAN_INTERVAL:
+        return
+    _last_expiry_scan = now
+    _prune()
+
+def _prune():
+    """删除过期结果；缓存仍超过上限时，按修改时间删除最旧的结果"""
+    _prune_locks()
+    cutoff = time.time() - RESULT_CACHE_TTL
+    try:
+        entries = []
+        total = 0
+        with os.scandir(RESULT_CACHE_DIR) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name.endswith('.tmp'):
+                    continue
+                stat = entry.stat()
+                if stat.st_mtime < cutoff:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= RESULT_CACHE_MAX_BYTES:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= RESULT_CACHE_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+    except FileNotFoundError:
+        # 还没有写入过任何结果
+        pass
+    except OSError as e:
+        logger.warning(f"Result cache prune failed: {e}")
@@ -13,6 +13,7 @@ const filterButtonsContainer = document.getElementById('filter-buttons');
 let currentImageData = null;
 let currentFilter = null;
 let isProcessing = false;
+let requestId = 0; // 每次请求的编号，用于忽略已过时的响应（用户换了图片）
 
 // Filter categories mapping
 const filterCategories = {
@@ -94,10 +95,12 @@ function handleFileChange() {
     if (uploadInput.files.length) {
         const file = uploadInput.files[0];
         
-        // 重置状态
+        // 重置状态（仍在处理中的旧图片结果返回后会被忽略）
         currentImageData = null;
         currentFilter = null;
         isProcessing = false;
+        requestId++;
+        setGenerateButtonLoading(false);
         
         // 清除提示信息
         if (flashMessage) {
@@ -164,13 +167,12 @@ filterButtons.forEach(button => {
         filterButtons.forEach(btn => btn.classList.remove('selected'));
         button.classList.add('selected');
         
-        // 只有在有图片上传时才处理
+        // 选择滤镜只在本地渲染预览，不上传图片；点击 Generate 才由服务端生成高质量结果
         if (uploadInput.files.length > 0) {
-            if (button.value !== currentFilter) {
-                processImage(button.value);
+            if (button.value === currentFilter && currentImageData) {
+                displayFilteredImage(currentImageData, button.value);
             } else {
-                // 如果滤镜相同，显示提示信息
-                showMessage('Same filter already applied - no processing needed');
+                showFilterPreview(button.value);
             }
         }
         // 如果没有上传图片，只更新UI状态，不显示任何提示
@@ -205,9 +207,9 @@ generateButton.addEventListener('click', e => {
     const selectedFilter = document.querySelector('.filter-btn.selected');
     const filterName = selectedFilter ? selectedFilter.value : 'ccd';
     
-    // 检查是否与当前已应用的滤镜相同
-    if (currentFilter && filterName === currentFilter) {
-        showMessage("This filter has already been applied to your image!");
+    // 已生成过该滤镜的结果时直接显示，不重复请求
+    if (currentFilter && filterName === currentFilter && currentImageData) {
+        displayFilteredImage(currentImageData, filterName);
         return;
     }
     
@@ -231,10 +233,187 @@ function displayFilteredImage(imageData, filterName) {
     showMessage('Photo generated successfully! You can download and save it');
 }
 
-function showGeneratingMessage() {
+function showFilterPreview(filterName) {
+    const preview = renderFilterPreview(filterName);
+    if (!preview) {
+        // 滤镜定义未加载或原图尚未解码，只提示用户生成
+        showPlaceholder();
+        return;
+    }
+    processedContainer.innerHTML = '<h3>- Filtered Result (Preview) -</h3><div class="processed-placeholder"><p class="processing-subtitle">Click the generate button for the full quality image!</p></div>';
+    preview.id = 'preview-processed';
+    processedContainer.insertBefore(preview, processedContainer.querySelector('.processed-placeholder'));
+}
+
+function showGeneratingMessage(filterName) {
+    // 有本地预览时先显示预览，等待服务端返回高质量结果
+    const preview = filterName ? renderFilterPreview(filterName) : null;
+    if (preview) {
+        processedContainer.innerHTML = '<h3>- Filtered Result (Preview) -</h3><div class="generating-message"><p class="processing-subtitle">Rendering full quality...</p><div class="rotating-circle"></div></div>';
+        preview.id = 'preview-processed';
+        processedContainer.insertBefore(preview, processedContainer.querySelector('.generating-message'));
+        return;
+    }
     processedContainer.innerHTML = '<h3>- Filtered Result -</h3><div class="generating-message"><p>Processing your image...</p><div class="rotating-circle"></div><p class="processing-subtitle">(This may only take a few seconds)</p></div>';
 }
 
+// ========== 本地滤镜预览 ==========
+// 滤镜定义由服务端 /filters.json 导出，选择滤镜时在 canvas 上渲染缩小版预览，
+// 只有点击 Generate 时才上传图片由服务端生成高质量结果
+const PREVIEW_MAX_SIZE = 800;
+let filterDefinitions = null;
+
+fetch('/filters.json')
+    .then(response => response.json())
+    .then(data => { filterDefinitions = data.filters; })
+    .catch(error => console.warn('Filter preview unavailable:', error));
+
+function renderFilterPreview(filterName) {
+    const source = document.getElementById('preview-original');
+    const definition = filterDefinitions && filterDefinitions[filterName];
+    if (!definition || !source || !source.complete || !source.naturalWidth) {
+        return null;
+    }
+    
+    const scale = Math.min(1, PREVIEW_MAX_SIZE / Math.max(source.naturalWidth, source.naturalHeight));
+    const canvas = document.createElement('canvas');
+    canvas.width = Math.max(1, Math.round(source.naturalWidth * scale));
+    canvas.height = Math.max(1, Math.round(source.naturalHeight * scale));
+    const ctx = canvas.getContext('2d');
+    ctx.drawImage(source, 0, 0, canvas.width, canvas.height);
+    
+    try {
+        let image = ctx.getImageData(0, 0, canvas.width, canvas.height);
+        pixelate(image, Math.round(definition.pixelate * scale));
+        definition.steps.forEach(step => {
+            if (step.op === 'blur') {
+                // 模糊交给 canvas 自带的滤镜处理
+                ctx.putImageData(image, 0, 0);
+                image = blurCanvas(canvas, step.radius * scale);
+            } else {
+                applyPreviewStep(image, step, scale);
+            }
+        });
+        ctx.putImageData(image, 0, 0);
+    } catch (error) {
+        console.warn('Filter preview failed:', error);
+        return null;
+    }
+    return canvas;
+}
+
+function pixelate(image, block) {
+    if (block < 2) return;
+    const { data, width, height } = image;
+    for (let y = 0; y < height; y++) {
+        const sy = Math.min(height - 1, y - (y % block) + (block >> 1));
+        for (let x = 0; x < width; x++) {
+            const sx = Math.min(width - 1, x - (x % block) + (block >> 1));
+            const i = (y * width + x) * 4;
+            const s = (sy * width + sx) * 4;
+            data[i] = data[s];
+            data[i + 1] = data[s + 1];
+            data[i + 2] = data[s + 2];
+        }
+    }
+}
+
+function blurCanvas(canvas, radius) {
+    const ctx = canvas.getContext('2d');
+    if (!('filter' in ctx) || radius <= 0) {
+        return ctx.getImageData(0, 0, canvas.width, canvas.height);
+    }
+    const copy = document.createElement('canvas');
+    copy.width = canvas.width;
+    copy.height = canvas.height;
+    copy.getContext('2d').drawImage(canvas, 0, 0);
+    ctx.filter = `blur(${radius}px)`;
+    ctx.drawImage(copy, 0, 0);
+    ctx.filter = 'none';
+    return ctx.getImageData(0, 0, canvas.width, canvas.height);
+}
+
+function clamp(value) {
+    return value < 0 ? 0 : value > 255 ? 255 : value;
+}
+
+function decodeLut(encoded) {
+    const raw = atob(encoded);
+    const lut = new Uint8Array(raw.length);
+    for (let i = 0; i < raw.length; i++) lut[i] = raw.charCodeAt(i);
+    return lut;
+}
+
+function applyPreviewStep(image, step, scale) {
+    const { data, width, height } = image;
+    const length = data.length;
+    
+    if (step.op === 'matrix') {
+        const m = step.matrix;
+        for (let i = 0; i < length; i += 4) {
+            const r = data[i], g = data[i + 1], b = data[i + 2];
+            data[i] = clamp(m[0] * r + m[1] * g + m[2] * b + m[3]);
+            data[i + 1] = clamp(m[4] * r + m[5] * g + m[6] * b + m[7]);
+            data[i + 2] = clamp(m[8] * r + m[9] * g + m[10] * b + m[11]);
+        }
+    } else if (step.op === 'contrast') {
+        // 以平均亮度为中心拉伸
+        let total = 0;
+        for (let i = 0; i < length; i += 4) {
+            total += 0.299 * data[i] + 0.587 * data[i + 1] + 0.114 * data[i + 2];
+        }
+        const mean = Math.round(total / (length / 4));
+        for (let i = 0; i < length; i += 4) {
+            data[i] = clamp(mean + step.factor * (data[i] - mean));
+            data[i + 1] = clamp(mean + step.factor * (data[i + 1] - mean));
+            data[i + 2] = clamp(mean + step.factor * (data[i + 2] - mean));
+        }
+    } else if (step.op === 'lut') {
+        const luts = step.lut.map(decodeLut);
+        for (let i = 0; i < length; i += 4) {
+            data[i] = luts[0][data[i]];
+            data[i + 1] = luts[1][data[i + 1]];
+            data[i + 2] = luts[2][data[i + 2]];
+        }
+    } else if (step.op === 'shift') {
+        const source = new Uint8ClampedArray(data);
+        step.offsets.forEach((offset, c) => {
+            const dx = Math.round(offset * scale);
+            if (dx === 0) return;
+            for (let y = 0; y < height; y++) {
+                for (let x = 0; x < width; x++) {
+                    const sx = x - dx;
+                    data[(y * width + x) * 4 + c] = sx >= 0 && sx < width ? source[(y * width + sx) * 4 + c] : 0;
+                }
+            }
+        });
+    } else if (step.op === 'convolve') {
+        const source = new Uint8ClampedArray(data);
+        const k = step.kernel;
+        const half = step.size >> 1;
+        for (let y = half; y < height - half; y++) {
+            for (let x = half; x < width - half; x++) {
+                for (let c = 0; c < 3; c++) {
+                    let sum = 0;
+                    for (let ky = 0; ky < step.size; ky++) {
+                        for (let kx = 0; kx < step.size; kx++) {
+                            sum += k[ky * step.size + kx] * source[((y + ky - half) * width + (x + kx - half)) * 4 + c];
+                        }
+                    }
+                    data[(y * width + x) * 4 + c] = clamp(sum / step.scale + step.offset);
+                }
+            }
+        }
+    } else if (step.op === 'grain') {
+        const n = step.intensity;
+        for (let i = 0; i < length; i += 4) {
+            data[i] = clamp(data[i] + Math.floor(Math.random() * (2 * n + 1)) - n);
+            data[i + 1] = clamp(data[i + 1] + Math.floor(Math.random() * (2 * n + 1)) - n);
+            data[i + 2] = clamp(data[i + 2] + Math.floor(Math.random() * (2 * n + 1)) - n);
+        }
+    }
+}
+
 function showPlaceholder() {
     processedContainer.innerHTML = '<h3>- Filtered Result -</h3><div class="processed-placeholder"><p>Click the generate button to see your filtered image!</p></div>';
 }
@@ -346,14 +525,16 @@ function processImage(filterName) {
         return;
     }
     
-    // 如果正在处理或滤镜相同，避免重复处理
-    if (isProcessing || filterName === currentFilter) {
+    // 正在处理时避免重复上传，预览仍可随时切换
+    if (isProcessing) {
+        showMessage('Still rendering the previous image, please wait a moment');
         return;
     }
     
+    const thisRequest = ++requestId;
     isProcessing = true;
     setGenerateButtonLoading(true);
-    showGeneratingMessage();
+    showGeneratingMessage(filterName);
     
     const formData = new FormData();
     formData.append('image', uploadInput.files[0]);
@@ -365,11 +546,19 @@ function processImage(filterName) {
     })
     .then(response => response.json())
     .then(data => {
+        if (thisRequest !== requestId) return;
         isProcessing = false;
         setGenerateButtonLoading(false);
         if (data.success) {
             currentFilter = filterName;
-            displayFilteredImage(data.filtered_image, data.filter_name);
+            currentImageData = data.filtered_image;
+            // 等待期间用户切换到其他滤镜的预览时，不覆盖预览
+            const selectedFilter = document.querySelector('.filter-btn.selected');
+            if (!selectedFilter || selectedFilter.value === filterName) {
+                displayFilteredImage(data.filtered_image, data.filter_name);
+            } else {
+                showMessage(`${filterName.replace('_', ' ').toUpperCase()} is ready, select it again to view`);
+            }
         } else {
             showMessage(data.error || 'Processing failed. Please try again');
             showPlaceholder();
@@ -377,6 +566,7 @@ function processImage(filterName) {
     })
     .catch(error => {
         console.error('Error:', error);
+        if (thisRequest !== requestId) return;
         isProcessing = false;
         setGenerateButtonLoading(false);
         showMessage('Network error occurred, please try again');